@@ -0,0 +1,116 @@
+# Scriba by Gabriele Battaglia (IZ4APU)
+# Benchmark del motore nativo (scriba_engine).
+# Uso:
+#   python bench_scriba.py albero [num_file]     -> memoria/voce su albero sintetico
+#   python bench_scriba.py scan <cartella>       -> scansione reale di una cartella
+#   python bench_scriba.py copia [mb] [dest]     -> singolo flusso vs multi-flusso
+#     (per misurare la rete indicare come dest una cartella sul NAS, es. \\server\share)
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+import tracemalloc
+
+import scriba_engine as engine
+
+def _albero_sintetico(num_file, file_per_dir=200, seme=42):
+    """Albero simile a una libreria musicale: Artista\\Album\\NN - Titolo.ext"""
+    rnd = random.Random(seme)
+    albero = engine.AlberoCompatto()
+    num_dir = max(1, num_file // file_per_dir)
+    num_artisti = max(1, int(num_dir ** 0.5))
+    primo = albero.aggiungi_figli(0, [(f"Artista {a:05d}", True, 0, 0) for a in range(num_artisti)])
+    album_per_artista = max(1, num_dir // num_artisti)
+    creati = 0
+    for a in range(num_artisti):
+        p_art = albero.aggiungi_figli(primo + a, [(f"Album {b:04d}", True, 0, 0) for b in range(album_per_artista)])
+        for b in range(album_per_artista):
+            n = min(file_per_dir, num_file - creati)
+            if n <= 0: break
+            voci = [(f"{t:03d} - Traccia {rnd.getrandbits(40):x}.flac", False,
+                     rnd.randint(1 << 20, 1 << 26), 1_700_000_000_000_000_000 + rnd.getrandbits(40))
+                    for t in range(n)]
+            voci.append(("cover.jpg", False, 120_000, 1_700_000_000_000_000_000))
+            albero.aggiungi_figli(p_art + b, voci)
+            creati += n + 1
+    return albero
+
+def bench_albero(num_file=1_000_000):
+    print(f"--- AlberoCompatto: {num_file} file sintetici ---")
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    albero = _albero_sintetico(num_file).congela()
+    t_build = time.perf_counter() - t0
+    corrente, picco = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    n = len(albero)
+    print(f"Voci:              {n}")
+    print(f"Costruzione:       {t_build:.2f} s")
+    print(f"Buffer:            {albero.memoria_bytes() / n:.1f} byte/voce")
+    print(f"Memoria residua:   {corrente / n:.1f} byte/voce (tracemalloc)")
+    print(f"Picco costruzione: {picco / n:.1f} byte/voce")
+
+    # Destinazione: stesso albero con circa l'1% di file modificati
+    dst = _albero_sintetico(num_file).congela()
+    for i in range(1, len(dst), 100):
+        if not dst.is_dir(i): dst.size[i] += 1
+    t0 = time.perf_counter()
+    conteggio = {}
+    for azione, _, _ in engine.diff_alberi(albero, dst):
+        conteggio[azione] = conteggio.get(azione, 0) + 1
+    t_diff = time.perf_counter() - t0
+    print(f"Diff in streaming: {t_diff:.2f} s ({n / t_diff:,.0f} voci/s) -> {conteggio}")
+
+def bench_scan(cartella):
+    print(f"--- Scansione: {cartella} ---")
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    albero = engine.scansiona_albero(cartella)
+    durata = time.perf_counter() - t0
+    corrente, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    n = len(albero)
+    print(f"Voci: {n} ({albero.num_file()} file), errori: {albero.errori}")
+    print(f"Tempo: {durata:.2f} s, memoria: {corrente / n:.1f} byte/voce")
+
+def bench_copia(mb=1024, dest=None):
+    print(f"--- Copia file da {mb} MB: singolo flusso vs multi-flusso ---")
+    cartella_src = tempfile.mkdtemp(prefix="scriba_bench_")
+    cartella_dst = tempfile.mkdtemp(prefix="scriba_bench_", dir=dest)
+    src = os.path.join(cartella_src, "grande.bin")
+    blocco = os.urandom(1024 * 1024)
+    with open(src, 'wb') as f:
+        for _ in range(mb): f.write(blocco)
+    byte = mb * 1024 * 1024
+
+    def _misura(etichetta, copia):
+        dst = os.path.join(cartella_dst, "grande.bin")
+        t0 = time.perf_counter()
+        copia(src, dst)
+        durata = time.perf_counter() - t0
+        os.remove(dst)
+        print(f"{etichetta:<32} {durata:7.2f} s  {byte / durata / 1024 / 1024:8.1f} MB/s")
+
+    try:
+        _misura("shutil.copyfile", shutil.copyfile)
+        for flussi in (1, 2, 4, 8):
+            _misura(f"multi-flusso x{flussi}", lambda s, d, n=flussi: engine.copia_multiflusso(s, d, flussi=n))
+        _misura("multi-flusso x4 con rilettura",
+                lambda s, d: engine.copia_multiflusso(s, d, flussi=4, verifica=True))
+    finally:
+        shutil.rmtree(cartella_src, ignore_errors=True)
+        shutil.rmtree(cartella_dst, ignore_errors=True)
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if not args or args[0] == "albero":
+        bench_albero(int(args[1]) if len(args) > 1 else 1_000_000)
+    elif args[0] == "scan" and len(args) > 1:
+        bench_scan(args[1])
+    elif args[0] == "copia":
+        bench_copia(int(args[1]) if len(args) > 1 else 1024, args[2] if len(args) > 2 else None)
+    else:
+        print("Uso: python bench_scriba.py [albero [num_file] | scan <cartella> | copia [mb] [dest]]")
@@ -13,6 +13,13 @@ import time
 import sys
 import platform
 import shutil
+import tempfile
+import math
+import threading
+import concurrent.futures
+
+import scriba_engine as engine
+import scriba_agent
 
 # Tenta di importare wxPython
 try:
@@ -35,8 +42,21 @@ PRESET_TEMPLATE = {
     "root_destinazione": "",
     "coppie_cartelle": [],
     "esclusioni": [],
+    "agente": None,
+    "prestazioni": None,
     "storico_stats": {}
 }
+# Valori usati quando il preset non ha una sezione "prestazioni"
+PRESTAZIONI_DEFAULT = {
+    "adattivo": False,
+    "concorrenza_max": 16,
+    "limite_banda_mbps": 0,
+    "limite_dalle": "08:00",
+    "limite_alle": "20:00",
+    "multiflusso_soglia_mb": 0,
+    "multiflusso_flussi": 0,
+    "multiflusso_verifica": False
+}
 
 # --- GESTIONE DATI E SICUREZZA ---
 
@@ -117,6 +137,18 @@ def stampa_dettaglio_esteso(preset):
     print(f"Periodicità:       {preset['giorni_periodicita']} giorni")
     print(f"Ultima Esecuzione: {preset['ultimo_backup'] or 'Mai'}")
     print(f"Root Destinazione: {preset['root_destinazione']}")
+    agente = preset.get("agente")
+    if agente:
+        print(f"Agente Dest.:      {agente['host']}:{agente.get('porta', scriba_agent.PORTA_DEFAULT)}")
+    prest = dict(PRESTAZIONI_DEFAULT, **(preset.get("prestazioni") or {}))
+    adattivo = f"Adattiva (max {prest['concorrenza_max']})" if prest["adattivo"] else "Fissa (Robocopy standard)"
+    print(f"Concorrenza:       {adattivo}")
+    if prest["limite_banda_mbps"]:
+        print(f"Limite Banda:      {prest['limite_banda_mbps']} Mbit/s ({prest['limite_dalle']}-{prest['limite_alle']})")
+    if prest["multiflusso_soglia_mb"]:
+        flussi = prest["multiflusso_flussi"] or "auto"
+        verifica = ", con rilettura" if prest["multiflusso_verifica"] else ""
+        print(f"Multi-flusso:      file oltre {prest['multiflusso_soglia_mb']} MB, flussi: {flussi}{verifica}")
     print("-" * 60)
     print(f"Cartelle da elaborare ({len(preset['coppie_cartelle'])}):")
     for c in preset['coppie_cartelle']:
@@ -181,11 +213,115 @@ def get_robocopy_plan(src, dst, user_exclusions=None):
 
     except Exception: return 0, 0
     return files_to_copy, bytes_to_copy
+# La riga di comando di Windows è limitata a 32767 caratteri
+MAX_CARATTERI_XF = 24000
+
+def get_robocopy_grandi(src, dst, soglia, user_exclusions=None):
+    """
+    Simulazione (/L) limitata ai file >= soglia che Robocopy copierebbe.
+    /XX nasconde gli EXTRA, /NC le classi (dipendenti dalla lingua): ogni riga
+    resta "dimensione percorso_completo". L'elenco si legge da un log /UNILOG
+    (UTF-16): in cp850 i nomi fuori codepage diventerebbero "?" e non si potrebbero
+    aprire, mentre /XF li escluderebbe comunque (jolly). Restituisce [(size, path)] o None se fallisce
+    o se i percorsi non stanno nella riga di comando (diventano voci /XF).
+    """
+    cmd_src = src.replace("\\\\?\\UNC\\", "\\\\").replace("\\\\?\\", "")
+    if cmd_src.endswith("\\") and not cmd_src.endswith(":\\"): cmd_src = cmd_src.rstrip("\\")
+    
+    cmd_dst = dst.replace("\\\\?\\UNC\\", "\\\\").replace("\\\\?\\", "")
+    if cmd_dst.endswith("\\") and not cmd_dst.endswith(":\\"): cmd_dst = cmd_dst.rstrip("\\")
+
+    cmd = ["robocopy", cmd_src, cmd_dst, "/E", "/XJ", "/R:1", "/W:1", "/FFT", "/L", "/XX", f"/MIN:{soglia}",
+           "/BYTES", "/FP", "/NJH", "/NJS", "/NDL", "/NC"]
+    cmd.extend(["/XD", "$RECYCLE.BIN", "System Volume Information"])
+    cmd.extend(["/XF", "pagefile.sys", "hiberfil.sys", "swapfile.sys"])
+    drive, tail = os.path.splitdrive(src)
+    if tail in ['\\', '/', ''] or src.endswith(':\\'):
+        cmd.extend(["/XD", "Recovery"])
+    if user_exclusions:
+        cmd.append("/XD")
+        cmd.extend(e.replace("\\\\?\\UNC\\", "\\\\").replace("\\\\?\\", "") for e in user_exclusions)
+
+    grandi = []
+    log_unicode = None
+    try:
+        fd, log_unicode = tempfile.mkstemp(prefix="scriba_grandi_", suffix=".txt")
+        os.close(fd)
+        cmd.append(f"/UNILOG:{log_unicode}")
+        startupinfo = subprocess.STARTUPINFO()
+        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        codice = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                startupinfo=startupinfo).returncode
+        # Codici >= 8 indicano un errore di Robocopy: meglio non escludere nulla
+        if codice >= 8: return None
+        with open(log_unicode, 'r', encoding='utf-16', errors='surrogatepass') as f_log:
+            for line in f_log:
+                parts = line.strip().split(maxsplit=1)
+                if len(parts) == 2 and parts[0].isdigit() and int(parts[0]) >= soglia:
+                    grandi.append((int(parts[0]), parts[1].strip()))
+    except Exception: return None
+    finally:
+        if log_unicode:
+            try: os.remove(log_unicode)
+            except OSError: pass
+    if sum(len(path) + 3 for _, path in grandi) > MAX_CARATTERI_XF: return None
+    return grandi
+def run_multiflusso(src, dst, log_file, grandi, is_simulation=False, flussi=engine.FLUSSI_DEFAULT,
+                    retry=1, attesa=1, limite_bps=0, verifica=False):
+    """
+    Copia multi-flusso dei file grandi esclusi da Robocopy con /XF.
+    Restituisce le statistiche parziali da sommare a quelle di Robocopy.
+    """
+    parziali = {"files_copied": 0, "bytes_copied": 0, "files_failed": 0, "bytes_failed": 0}
+    if not grandi: return parziali
+    cmd_src = src.replace("\\\\?\\UNC\\", "\\\\").replace("\\\\?\\", "")
+    if cmd_src.endswith("\\") and not cmd_src.endswith(":\\"): cmd_src = cmd_src.rstrip("\\")
+    limitatore = engine.LimitatoreBanda(limite_bps) if limite_bps else None
+    try: f_log = open(log_file, 'a', encoding='utf-8')
+    except OSError as e:
+        # Il log non deve fermare la copia: i file sono già esclusi da Robocopy
+        print(f"\nAVVISO: log non scrivibile ({e}), copia multi-flusso senza log.")
+        f_log = open(os.devnull, 'w', encoding='utf-8')
+    with f_log:
+        f_log.write(f"\n--- COPIA MULTI-FLUSSO ({flussi} flussi): {len(grandi)} file ---\n")
+        for size, path in grandi:
+            rel = os.path.relpath(path, cmd_src)
+            if is_simulation:
+                parziali["files_copied"] += 1
+                parziali["bytes_copied"] += size
+                f_log.write(f"\t{size}\t{path}\n")
+                continue
+            try:
+                esito = engine.copia_multiflusso(fix_long_path(path), os.path.join(dst, rel), flussi=flussi,
+                                                 retry=retry, attesa=attesa, verifica=verifica,
+                                                 limitatore=limitatore)
+                parziali["files_copied"] += 1
+                parziali["bytes_copied"] += esito["byte"]
+                vel = esito["byte"] / esito["secondi"] if esito["secondi"] > 0 else 0
+                f_log.write(f"\t{size}\t{path}\t{format_size(vel)}/s, {esito['intervalli']} intervalli, "
+                            f"{esito['ritentati']} ritentati\n")
+            except OSError as e:
+                parziali["files_failed"] += 1
+                parziali["bytes_failed"] += size
+                f_log.write(f"\tERRORE multi-flusso\t{path}: {e}\n")
+    return parziali
+def ipg_robocopy(limite_bps):
+    """
+    Converte un limite di banda in /IPG (ms di pausa tra blocchi da 64 KB).
+    /IPG non è compatibile con /MT: la copia è a thread singolo e la banda è
+    circa 64 KB / IPG. È una stima, Robocopy non ha un limite esatto.
+    """
+    if not limite_bps: return 0
+    return max(1, math.ceil(65536 * 1000 / limite_bps))
 def run_robocopy_engine(src, dst, log_file, user_exclusions=None, is_simulation=False, 
-                        total_bytes_global=0, current_bytes_global=0, start_time_global=0, current_task_name=""):
+                        total_bytes_global=0, current_bytes_global=0, start_time_global=0, current_task_name="",
+                        mostra_avanzamento=True, concorrenza=None, retry=1, attesa=1, limite_bps=0,
+                        escludi_file=None):
     """
     Esegue Robocopy in modo sincrono e pulito.
     Scrive il log e restituisce le statistiche finali.
+    concorrenza -> /MT, retry/attesa -> /R /W, limite_bps -> /IPG (approssimato, esclude /MT),
+    escludi_file -> voci /XF aggiuntive (i file grandi lasciati alla copia multi-flusso).
     """
     cmd_src = src.replace("\\\\?\\UNC\\", "\\\\").replace("\\\\?\\", "")
     if cmd_src.endswith("\\") and not cmd_src.endswith(":\\"): cmd_src = cmd_src.rstrip("\\")
@@ -193,10 +329,14 @@ def run_robocopy_engine(src, dst, log_file, user_exclusions=None, is_simulation=
     cmd_dst = dst.replace("\\\\?\\UNC\\", "\\\\").replace("\\\\?\\", "")
     if cmd_dst.endswith("\\") and not cmd_dst.endswith(":\\"): cmd_dst = cmd_dst.rstrip("\\")
 
-    cmd = ["robocopy", cmd_src, cmd_dst, "/MIR", "/XJ", "/R:1", "/W:1", "/FFT", "/NDL", "/NP", "/BYTES"]
+    cmd = ["robocopy", cmd_src, cmd_dst, "/MIR", "/XJ", f"/R:{retry}", f"/W:{attesa}", "/FFT", "/NDL", "/NP", "/BYTES"]
+    ipg = ipg_robocopy(limite_bps)
+    if ipg: cmd.append(f"/IPG:{ipg}")
+    elif concorrenza: cmd.append(f"/MT:{concorrenza}")
     
     cmd.extend(["/XD", "$RECYCLE.BIN", "System Volume Information"])
     cmd.extend(["/XF", "pagefile.sys", "hiberfil.sys", "swapfile.sys"])
+    if escludi_file: cmd.extend(escludi_file)
     drive, tail = os.path.splitdrive(src)
     if tail in ['\\', '/', ''] or src.endswith(':\\'):
         cmd.extend(["/XD", "Recovery"])
@@ -218,7 +358,7 @@ def run_robocopy_engine(src, dst, log_file, user_exclusions=None, is_simulation=
         "bytes_total": 0, "bytes_copied": 0, "bytes_skipped": 0, "bytes_failed": 0
     }
     
-    print(f"   --> In corso: {current_task_name}...", end="", flush=True)
+    if mostra_avanzamento: print(f"   --> In corso: {current_task_name}...", end="", flush=True)
 
     try:
         process = subprocess.Popen(
@@ -239,14 +379,25 @@ def run_robocopy_engine(src, dst, log_file, user_exclusions=None, is_simulation=
                 if summary_started:
                     summary_lines.append(line)
 
-        process.wait()
+        # Codice 8: alcuni file non copiati (restano nei falliti).
+        # Codice >= 16: errore grave, Robocopy non ha copiato nulla (es. comando rifiutato)
+        codice = process.wait()
+        if codice >= 16:
+            final_stats["errore"] = f"Robocopy terminato con codice {codice}"
+            print(f"\nErrore Robocopy: codice di uscita {codice}, vedere il log.")
 
         # Parsing statistiche finali
+        riepilogo_trovato = False
         for l in summary_lines:
             l_low = l.lower()
             if ":" not in l: continue
             nums = [int(x) for x in l.replace(":", " ").split() if x.isdigit()]
+            # Riga "Speed : n Bytes/sec." (tempo di sola copia): serve al controllo adattivo
+            if nums and ("bytes/s" in l_low or "byte/s" in l_low):
+                final_stats["velocita_bps"] = nums[0]
+                continue
             if len(nums) < 6: continue
+            riepilogo_trovato = True
             
             if "dir" in l_low or "cartell" in l_low:
                 final_stats["dirs_total"] = nums[0]; final_stats["dirs_copied"] = nums[1]
@@ -258,44 +409,153 @@ def run_robocopy_engine(src, dst, log_file, user_exclusions=None, is_simulation=
                 final_stats["bytes_total"] = nums[0]; final_stats["bytes_copied"] = nums[1]
                 final_stats["bytes_skipped"] = nums[2]; final_stats["bytes_failed"] = nums[4]
 
+        if not riepilogo_trovato and "errore" not in final_stats:
+            final_stats["errore"] = f"Riepilogo Robocopy assente (codice {codice})"
+            print(f"\nErrore Robocopy: riepilogo assente, vedere il log.")
+
         return final_stats, final_stats["bytes_copied"]
 
     except Exception as e:
         print(f"\nErrore Robocopy: {e}")
+        final_stats["errore"] = str(e)
         return final_stats, 0
-def esegui_backup(preset_index=None, simulazione=False):
-    settings = load_settings()
-    if settings is None: return 
-    
-    presets = settings["presets"]
-    current_machine = get_machine_id()
-    
-    if preset_index is None:
-        print("\nQuale preset vuoi eseguire?")
-        for i, p in enumerate(presets):
-            mod_sim = " [SIMULAZIONE]" if simulazione else ""
-            print(f"{i + 1}. {p['titolo']}{mod_sim}")
+def run_agent_engine(src, nome_cartella, log_file, client, user_exclusions=None,
+                     is_simulation=False, current_task_name="", mostra_avanzamento=True,
+                     retry=1, attesa=1, limite_bps=0):
+    """
+    Alternativa a Robocopy quando il preset ha un agente di destinazione.
+    Origine scansionata in locale, destinazione elencata dall'agente, diff in
+    streaming e scritture in blocco via TCP. Stesse statistiche di run_robocopy_engine.
+    retry/attesa e limite_bps hanno lo stesso ruolo di /R, /W e /IPG.
+    """
+    final_stats = {
+        "dirs_total": 0, "dirs_copied": 0, "dirs_skipped": 0, "dirs_failed": 0,
+        "files_total": 0, "files_copied": 0, "files_skipped": 0, "files_failed": 0,
+        "bytes_total": 0, "bytes_copied": 0, "bytes_skipped": 0, "bytes_failed": 0
+    }
+    if mostra_avanzamento: print(f"   --> In corso (agente): {current_task_name}...", end="", flush=True)
+    limitatore = engine.LimitatoreBanda(limite_bps) if limite_bps else None
+
+    # Le esclusioni utente sono percorsi di origine: all'agente vanno relative
+    user_exclusions = user_exclusions or []
+    excl_rel = []
+    for e in user_exclusions:
         try:
-            sel = int(input("Scelta (0 per annullare): ")) - 1
-            if sel == -1: return
-            preset = presets[sel]
-            preset_index = sel
-        except (ValueError, IndexError): return
-    else:
-        preset = presets[preset_index]
+            rel = os.path.relpath(fix_long_path(e), src)
+            if not rel.startswith(".."): excl_rel.append(rel.replace(os.sep, "/"))
+        except ValueError: pass
 
-    stampa_dettaglio_esteso(preset)
-    tipo_run = "SIMULAZIONE" if simulazione else "BACKUP REALE"
-    print(f"Stai per lanciare: {tipo_run}")
-    if input("Vuoi procedere? (s/n): ").lower() != 's': return
+    try:
+        with open(log_file, 'w', encoding='utf-8') as f_log:
+            f_log.write(f"--- AVVIO (AGENTE): {datetime.datetime.now()} ---\nSRC: {src}\nDST: {nome_cartella}\n\n")
+            albero_src = engine.scansiona_albero(src, esclusioni_dir=[fix_long_path(e) for e in user_exclusions])
+            if not is_simulation: client.crea_dir([nome_cartella])
+            albero_dst = client.lista(nome_cartella, esclusioni=excl_rel)
+
+            num_dir = len(albero_src) - albero_src.num_file()
+            final_stats["dirs_total"] = num_dir
+            final_stats["files_total"] = albero_src.num_file()
+            final_stats["bytes_total"] = albero_src.byte_totali()
+            final_stats["files_failed"] = albero_src.errori
+
+            # Eliminazioni e nuove cartelle vanno all'agente a lotti limitati:
+            # nessuna lista per voce, la memoria resta quella dei due alberi
+            extra, nuove_dir = [], []
+
+            def _svuota_comandi():
+                if not is_simulation:
+                    if extra:
+                        for rel, err in client.elimina(extra):
+                            f_log.write(f"\tERRORE eliminazione\t{rel}: {err}\n")
+                    if nuove_dir:
+                        for rel, err in client.crea_dir(nuove_dir):
+                            final_stats["dirs_failed"] += 1
+                            f_log.write(f"\tERRORE creazione dir\t{rel}: {err}\n")
+                extra.clear()
+                nuove_dir.clear()
+
+            def _da_copiare():
+                """Percorre il diff in streaming e produce (path_locale, rel_remoto, size)."""
+                for azione, i, j in engine.diff_alberi(albero_src, albero_dst):
+                    if azione == engine.DIFF_EXTRA:
+                        rel = albero_dst.percorso(j, "/")
+                        extra.append(f"{nome_cartella}/{rel}")
+                        f_log.write(f"\t*EXTRA\t\t{rel}\n")
+                    elif albero_src.is_dir(i):
+                        rel = albero_src.percorso(i, "/")
+                        nuove_dir.append(f"{nome_cartella}/{rel}")
+                        final_stats["dirs_copied"] += 1
+                        f_log.write(f"\tNuova Dir\t\t{rel}\n")
+                    else:
+                        rel = albero_src.percorso(i, "/")
+                        size = albero_src.size[i]
+                        etichetta = "Nuovo File" if azione == engine.DIFF_NUOVO else "Modificato"
+                        f_log.write(f"\t{etichetta}\t{size}\t{rel}\n")
+                        yield (os.path.join(src, albero_src.percorso(i)), f"{nome_cartella}/{rel}", size)
+                    if len(extra) + len(nuove_dir) >= scriba_agent.LOTTO_MAX_COMANDI: _svuota_comandi()
+
+            falliti = []
+            for lotto in scriba_agent.lotti_scrittura(_da_copiare()):
+                # Le eliminazioni in sospeso precedono le scritture (cambi file <-> cartella)
+                _svuota_comandi()
+                if is_simulation:
+                    final_stats["files_copied"] += len(lotto)
+                    final_stats["bytes_copied"] += sum(size for _, _, size in lotto)
+                    continue
+                try:
+                    esiti = client.scrivi([(path, rel) for path, rel, _ in lotto], limitatore)
+                except OSError as e:
+                    if isinstance(e, (ConnectionError, TimeoutError)): raise
+                    # File locale illeggibile: il lotto non è partito, si ritenta uno per uno
+                    esiti = []
+                    for path, rel, _ in lotto:
+                        try: esiti.extend(client.scrivi([(path, rel)], limitatore))
+                        except OSError as e1:
+                            if isinstance(e1, (ConnectionError, TimeoutError)): raise
+                            esiti.append((False, str(e1)))
+                for (path, rel, size), (ok, err) in zip(lotto, esiti):
+                    if ok:
+                        final_stats["files_copied"] += 1
+                        final_stats["bytes_copied"] += size
+                    else:
+                        falliti.append((path, rel, size, err))
+            _svuota_comandi()
+
+            if not is_simulation:
+                # Tentativi con attesa, come /R e /W di Robocopy
+                for tentativo in range(retry):
+                    if not falliti: break
+                    time.sleep(attesa)
+                    ancora = []
+                    for path, rel, size, err in falliti:
+                        try: ok, err = client.scrivi([(path, rel)], limitatore)[0]
+                        except OSError as e:
+                            if isinstance(e, (ConnectionError, TimeoutError)): raise
+                            ok, err = False, str(e)
+                        if ok:
+                            final_stats["files_copied"] += 1
+                            final_stats["bytes_copied"] += size
+                        else:
+                            ancora.append((path, rel, size, err))
+                    falliti = ancora
+                for path, rel, size, err in falliti:
+                    final_stats["files_failed"] += 1
+                    final_stats["bytes_failed"] += size
+                    f_log.write(f"\tERRORE copia\t{rel}: {err}\n")
+
+            final_stats["dirs_skipped"] = num_dir - final_stats["dirs_copied"]
+            final_stats["files_skipped"] = max(0, final_stats["files_total"] - final_stats["files_copied"] - final_stats["files_failed"])
+            final_stats["bytes_skipped"] = max(0, final_stats["bytes_total"] - final_stats["bytes_copied"] - final_stats["bytes_failed"])
+            f_log.write(f"\n--- FINE: {datetime.datetime.now()} ---\n{json.dumps(final_stats, indent=4)}\n")
 
-    preset_machine = preset.get("machine_id", "Sconosciuto")
-    if preset_machine != current_machine and not simulazione:
-        print(f"\nATTENZIONE: ID Macchina non corrispondente ({preset_machine}).")
-        if input("Scrivi 'SI' per forzare: ") != "SI": return
+        return final_stats, final_stats["bytes_copied"]
 
-    # --- CONTROLLO ESISTENZA ORIGINI ---
-    root_dest = preset["root_destinazione"]
+    except (OSError, scriba_agent.ErroreAgente) as e:
+        print(f"\nErrore Agente: {e}")
+        final_stats["errore"] = str(e)
+        return final_stats, final_stats["bytes_copied"]
+def _cartelle_valide(preset):
+    """Controllo esistenza origini: restituisce solo le coppie con origine presente."""
     cartelle_valide = []
     for c in preset["coppie_cartelle"]:
         src = fix_long_path(c["origine"])
@@ -303,43 +563,68 @@ def esegui_backup(preset_index=None, simulazione=False):
             cartelle_valide.append(c)
         else:
             print(f"AVVISO: Origine non trovata, verrà saltata: {c['origine']}")
-    
-    if not cartelle_valide:
-        print("Nessuna cartella valida da copiare.")
-        return
-
-    if not simulazione and preset["ultimo_backup"]:
-        try:
-            d = datetime.datetime.strptime(preset["ultimo_backup"], "%Y-%m-%d").date()
-            if (datetime.date.today() - d).days < preset["giorni_periodicita"]:
-                print("AVVISO: Periodicità non ancora scaduta.")
-                if input("Procedere comunque? (s/n): ").lower() != 's': return
-        except: pass
-
-    spegni_pc = False
-    if not simulazione:
-        spegni_pc = (input("\nVuoi spegnere il PC al termine? (s/n): ").lower() == 's')
+    return cartelle_valide
 
+def _chiave_destinazione(preset):
+    """
+    Identifica il dispositivo di destinazione (host UNC, agente o unità).
+    Preset con chiavi diverse possono girare in parallelo senza contendersi lo stesso disco.
+    """
+    if preset.get("agente"):
+        return ("agente", preset["agente"]["host"].lower())
+    root = preset["root_destinazione"].replace("/", "\\")
+    if root.startswith("\\\\"):
+        return ("unc", root.lstrip("\\").split("\\")[0].lower())
+    return ("disco", os.path.splitdrive(os.path.abspath(root))[0].lower())
+
+def _esegui_preset(preset, cartelle_valide, simulazione, console_lock=None):
+    """
+    Esegue tutte le cartelle di un preset senza alcuna interazione.
+    Con console_lock (esecuzione in coda parallela) ogni riga è completa e porta il titolo.
+    Restituisce il riepilogo della sessione.
+    """
+    root_dest = preset["root_destinazione"]
     start_total = time.time()
     log_dir = os.path.join(root_dest, "Logs")
     if not os.path.exists(log_dir):
         try: os.makedirs(log_dir)
         except: pass 
 
-    # --- ESECUZIONE ---
-    print(f"\n--- Esecuzione {tipo_run} ---")
-    
-    global_bytes_processed = 0
-    start_run_time = time.time()
-    
-    report_files_copied = 0
-    report_bytes_copied = 0
-    report_files_failed = 0
-    report_files_skipped = 0
-    report_bytes_skipped = 0
-    
-    snapshot_files = 0
-    snapshot_bytes = 0
+    def _stampa(msg):
+        if console_lock is None: print(msg)
+        else:
+            with console_lock: print(f"[{preset['titolo']}] {msg.strip()}")
+
+    # --- AGENTE DI DESTINAZIONE (opzionale) ---
+    client_agente = None
+    conf_agente = preset.get("agente")
+    if conf_agente:
+        try:
+            client_agente = scriba_agent.ClientAgente.da_preset(conf_agente)
+            client_agente.ping()
+            _stampa(f"\nAgente di destinazione connesso: {conf_agente['host']}")
+        except (OSError, scriba_agent.ErroreAgente) as e:
+            _stampa(f"\nAVVISO: Agente non raggiungibile ({e}). Uso Robocopy.")
+            if client_agente: client_agente.chiudi()
+            client_agente = None
+
+    # --- CONTROLLO ADATTIVO (concorrenza, backoff, limite di banda) ---
+    # Solo per Robocopy: l'agente scrive in un unico flusso e non usa la concorrenza
+    prestazioni = dict(PRESTAZIONI_DEFAULT, **(preset.get("prestazioni") or {}))
+    controllore = None
+    if prestazioni["adattivo"] and not client_agente:
+        appresa = preset.get("storico_stats", {}).get(get_machine_id(), {}).get("concorrenza_mt")
+        controllore = engine.ControlloreAdattivo(appresa or engine.CONCORRENZA_INIZIALE,
+                                                 prestazioni["concorrenza_max"])
+
+    riepilogo = {
+        "files_copied": 0, "bytes_copied": 0, "files_failed": 0,
+        "files_skipped": 0, "bytes_skipped": 0,
+        "snapshot_files": 0, "snapshot_bytes": 0,
+        "durata": 0.0, "log_dir": log_dir,
+        "controllo": controllore.decisioni if controllore else [],
+        "concorrenza_finale": None, "errori": []
+    }
 
     for i, coppia in enumerate(cartelle_valide):
         src = fix_long_path(coppia["origine"])
@@ -348,60 +633,147 @@ def esegui_backup(preset_index=None, simulazione=False):
         log_file = os.path.join(log_dir, f"{nome_dir}-log.txt")
         
         task_start_time = time.time()
-
-        stats, bytes_fatti = run_robocopy_engine(
-            src, dst, log_file,
-            user_exclusions=preset.get("esclusioni", []),
-            is_simulation=simulazione,
-            current_task_name=nome_dir
-        )
+        if console_lock is not None: _stampa(f"   --> In corso: {nome_dir}...")
+
+        # Il limite si valuta a ogni cartella: una sessione lunga può uscire dalla fascia
+        limite_bps = engine.limite_banda_attivo(prestazioni)
+        if controllore:
+            param = controllore.parametri()
+            # Con il limite attivo /IPG esclude /MT: la concorrenza resta in sospeso
+            if limite_bps: param["concorrenza"] = None
+        else:
+            param = {"concorrenza": None, "retry": engine.RETRY_BASE, "attesa": engine.ATTESA_BASE}
+
+        if client_agente:
+            stats, bytes_fatti = run_agent_engine(
+                src, nome_dir, log_file, client_agente,
+                user_exclusions=preset.get("esclusioni", []),
+                is_simulation=simulazione,
+                current_task_name=nome_dir,
+                mostra_avanzamento=console_lock is None,
+                retry=param["retry"], attesa=param["attesa"], limite_bps=limite_bps
+            )
+            # Dopo un errore la connessione può essere fuori sincrono o chiusa: si riapre
+            if stats.get("errore"):
+                try:
+                    client_agente.riconnetti()
+                    client_agente.ping()
+                except (OSError, scriba_agent.ErroreAgente) as e:
+                    _stampa(f"\nAVVISO: Agente non raggiungibile ({e}). Uso Robocopy per le cartelle rimanenti.")
+                    client_agente.chiudi()
+                    client_agente = None
+        else:
+            # File oltre soglia: esclusi da Robocopy e copiati a intervalli paralleli
+            soglia = int(prestazioni["multiflusso_soglia_mb"] * 1024 * 1024)
+            grandi = None
+            if soglia > 0:
+                grandi = get_robocopy_grandi(src, dst, soglia, preset.get("esclusioni", []))
+            stats, bytes_fatti = run_robocopy_engine(
+                src, dst, log_file,
+                user_exclusions=preset.get("esclusioni", []),
+                is_simulation=simulazione,
+                current_task_name=nome_dir,
+                mostra_avanzamento=console_lock is None,
+                concorrenza=param["concorrenza"], retry=param["retry"],
+                attesa=param["attesa"], limite_bps=limite_bps,
+                escludi_file=[path for _, path in grandi] if grandi else None
+            )
+            # Campione del controllo adattivo: solo la copia di Robocopy (/MT), non il multi-flusso
+            byte_mt, vel_mt = stats.get("bytes_copied", 0), stats.get("velocita_bps", 0)
+            if grandi:
+                flussi = prestazioni["multiflusso_flussi"] or param["concorrenza"] or engine.FLUSSI_DEFAULT
+                parziali = run_multiflusso(src, dst, log_file, grandi, simulazione, flussi,
+                                           param["retry"], param["attesa"], limite_bps,
+                                           prestazioni["multiflusso_verifica"])
+                # Robocopy conta i file esclusi da /XF come saltati: passano a copiati/falliti
+                for chiave in ("files", "bytes"):
+                    gestiti = parziali[f"{chiave}_copied"] + parziali[f"{chiave}_failed"]
+                    stats[f"{chiave}_copied"] = stats.get(f"{chiave}_copied", 0) + parziali[f"{chiave}_copied"]
+                    stats[f"{chiave}_failed"] = stats.get(f"{chiave}_failed", 0) + parziali[f"{chiave}_failed"]
+                    stats[f"{chiave}_skipped"] = max(0, stats.get(f"{chiave}_skipped", 0) - gestiti)
+                bytes_fatti += parziali["bytes_copied"]
         
-        global_bytes_processed += bytes_fatti
-        report_files_copied += stats.get("files_copied", 0)
-        report_files_failed += stats.get("files_failed", 0)
-        report_files_skipped += stats.get("files_skipped", 0)
-        report_bytes_copied += stats.get("bytes_copied", 0)
-        report_bytes_skipped += stats.get("bytes_skipped", 0)
-        snapshot_files += stats.get("files_total", 0)
-        snapshot_bytes += stats.get("bytes_total", 0)
+        riepilogo["files_copied"] += stats.get("files_copied", 0)
+        riepilogo["files_failed"] += stats.get("files_failed", 0)
+        riepilogo["files_skipped"] += stats.get("files_skipped", 0)
+        riepilogo["bytes_copied"] += stats.get("bytes_copied", 0)
+        riepilogo["bytes_skipped"] += stats.get("bytes_skipped", 0)
+        riepilogo["snapshot_files"] += stats.get("files_total", 0)
+        riepilogo["snapshot_bytes"] += stats.get("bytes_total", 0)
+        if stats.get("errore"): riepilogo["errori"].append(f"{nome_dir}: {stats['errore']}")
 
         task_duration = time.time() - task_start_time
+        if controllore and param["concorrenza"] and not simulazione and not stats.get("errore"):
+            # Il tempo di copia viene dalla riga "Speed" di Robocopy: la durata della cartella
+            # includerebbe la scansione dei file invariati
+            d = controllore.registra(nome_dir, byte_mt, byte_mt / vel_mt if vel_mt else None,
+                                     stats.get("files_copied", 0), stats.get("files_failed", 0))
+            try:
+                with open(log_file, 'a', encoding='utf-8') as f_log:
+                    f_log.write(f"\n--- CONTROLLO ADATTIVO ---\n{json.dumps(d, indent=4)}\n")
+            except OSError: pass
         m_task, s_task = divmod(int(task_duration), 60)
-        print(f" [OK] ({i+1}/{len(cartelle_valide)}) - Tempo: {m_task:02d}:{s_task:02d}")
+        esito = "ERRORE" if stats.get("errore") else "OK"
+        if console_lock is None:
+            print(f" [{esito}] ({i+1}/{len(cartelle_valide)}) - Tempo: {m_task:02d}:{s_task:02d}")
+        else:
+            _stampa(f"[{esito}] {nome_dir} ({i+1}/{len(cartelle_valide)}) - Tempo: {m_task:02d}:{s_task:02d}")
 
-    print("\n" + "="*60) 
+    if client_agente: client_agente.chiudi()
+    if controllore: riepilogo["concorrenza_finale"] = controllore.concorrenza
+    riepilogo["durata"] = time.time() - start_total
+    return riepilogo
 
-    # ============================================================
-    # REPORT FINALE (COMPARATIVO)
-    # ============================================================
-    
-    # Gestione Storico Stats
+def _aggiorna_storico(preset, riepilogo, simulazione):
+    """
+    Aggiorna ultimo backup e storico stats del preset (solo se non simulazione
+    e senza cartelle fallite: il backup resta scaduto).
+    Restituisce i dati precedenti per il confronto. Il salvataggio è a carico del chiamante.
+    """
     current_machine = get_machine_id()
     if "storico_stats" not in preset: preset["storico_stats"] = {}
     
     # Recupero dati precedenti
     prev_data = preset["storico_stats"].get(current_machine, {})
-    prev_files = prev_data.get("total_files", 0)
-    prev_bytes = prev_data.get("total_bytes", 0)
-    last_run_date = prev_data.get("last_run_date", "Mai")
+    precedente = {
+        "total_files": prev_data.get("total_files", 0),
+        "total_bytes": prev_data.get("total_bytes", 0),
+        "last_run_date": prev_data.get("last_run_date", "Mai")
+    }
 
-    # Aggiornamento dati (solo se non simulazione)
-    if not simulazione and settings:
+    # Aggiornamento dati (solo se non simulazione e senza errori)
+    if not simulazione and not riepilogo.get("errori"):
         preset["ultimo_backup"] = datetime.date.today().strftime("%Y-%m-%d")
         preset["storico_stats"][current_machine] = {
             "last_run_date": datetime.date.today().strftime("%Y-%m-%d"),
-            "total_files": snapshot_files,
-            "total_bytes": snapshot_bytes
+            "total_files": riepilogo["snapshot_files"],
+            "total_bytes": riepilogo["snapshot_bytes"]
         }
-        save_settings(settings)
-    
-    total_time = time.time() - start_total
-    m_tot, s_tot = divmod(total_time, 60)
+        # La concorrenza appresa è il punto di partenza del prossimo backup
+        if riepilogo.get("concorrenza_finale"):
+            preset["storico_stats"][current_machine]["concorrenza_mt"] = riepilogo["concorrenza_finale"]
+    return precedente
+
+def _formatta_durata(secondi):
+    m_tot, s_tot = divmod(secondi, 60)
     h_tot, m_tot = divmod(m_tot, 60)
+    return f"{int(h_tot):02d}:{int(m_tot):02d}:{s_tot:06.3f}"
+
+def _stampa_report_sessione(tipo_run, riepilogo, precedente):
+    report_files_copied = riepilogo["files_copied"]
+    report_bytes_copied = riepilogo["bytes_copied"]
+    report_files_failed = riepilogo["files_failed"]
+    report_files_skipped = riepilogo["files_skipped"]
+    snapshot_files = riepilogo["snapshot_files"]
+    snapshot_bytes = riepilogo["snapshot_bytes"]
+    prev_files = precedente["total_files"]
+    prev_bytes = precedente["total_bytes"]
+    last_run_date = precedente["last_run_date"]
+    total_time = riepilogo["durata"]
     
     print(f"\nRIEPILOGO SESSIONE - {tipo_run}")
     print("="*60)
-    print(f"Tempo Totale:     {int(h_tot):02d}:{int(m_tot):02d}:{s_tot:06.3f}")
+    print(f"Tempo Totale:     {_formatta_durata(total_time)}")
     
     # Velocità Media Reale (basata sul trasferito effettivo)
     speed_str = "0.00 B/s"
@@ -413,7 +785,6 @@ def esegui_backup(preset_index=None, simulazione=False):
     print(f"{'STATISTICHE OPERAZIONI (Sessione Corrente)':<50}")
     print("-" * 60)
     
-    tot_ops = report_files_copied + report_files_skipped + report_files_failed
     print(f"File Copiati:    {str(report_files_copied):<10} ({format_size(report_bytes_copied)})")
     print(f"File Invariati:  {str(report_files_skipped):<10} (Saltati)")
     print(f"File Falliti:    {str(report_files_failed):<10}")
@@ -445,14 +816,32 @@ def esegui_backup(preset_index=None, simulazione=False):
         print(f"{'Dimensioni':<15} {format_size(prev_bytes):<15} {format_size(snapshot_bytes):<15} {sign_b}{format_size(diff_bytes)} ({sign_b}{perc_bytes:.2f}%)")
         print(f"{'Numero File':<15} {str(prev_files):<15} {str(snapshot_files):<15} {sign_f}{diff_files} ({sign_f}{perc_files:.2f}%)")
 
-    if report_files_failed > 0:
+    _stampa_controllo(riepilogo)
+
+    if report_files_failed > 0 or riepilogo.get("errori"):
         print("\n" + "!"*60)
+        for e in riepilogo.get("errori", []): print(f" ERRORE CARTELLA {e}")
         print(f" ATTENZIONE: {report_files_failed} file NON sono stati copiati per errore.")
         print(" CONTROLLARE I LOG NELLA CARTELLA DI DESTINAZIONE!")
         print("!"*60)
 
     print("="*60)
 
+def _stampa_controllo(riepilogo, titolo=None):
+    decisioni = riepilogo.get("controllo")
+    if not decisioni: return
+    print("-" * 60)
+    intestazione = "CONTROLLO ADATTIVO" + (f" - {titolo}" if titolo else "")
+    print(f"{intestazione:<50}")
+    print("-" * 60)
+    print(f"{'CARTELLA':<16} {'MT':<4} {'VELOCITÀ':<14} {'ERR':<7} {'DECISIONE'}")
+    for d in decisioni:
+        nome = smart_truncate(d["etichetta"], 16)
+        vel = f"{format_size(d['throughput_bps'])}/s"
+        print(f"{nome:<16} {d['concorrenza']:<4} {vel:<14} {d['tasso_errori']:<7.1%} "
+              f"{d['azione']} -> MT:{d['prossima_concorrenza']} R:{d['prossimi_retry']} W:{d['prossima_attesa']} ({d['motivo']})")
+
+def _fine_sessione(spegni_pc, log_dirs):
     if spegni_pc:
         print("\nSpegnimento tra 60s. CTRL+C per annullare.")
         try:
@@ -462,9 +851,183 @@ def esegui_backup(preset_index=None, simulazione=False):
             os.system("shutdown /a")
             print("\nSpegnimento annullato.")
     else:
-        if os.path.exists(log_dir):
-            print(f"\nLogs salvati in: {log_dir}")
+        for log_dir in log_dirs:
+            if os.path.exists(log_dir):
+                print(f"\nLogs salvati in: {log_dir}")
         input("\nPremi INVIO per tornare al menu...")
+
+def esegui_backup(preset_index=None, simulazione=False):
+    settings = load_settings()
+    if settings is None: return 
+    
+    presets = settings["presets"]
+    current_machine = get_machine_id()
+    
+    if preset_index is None:
+        print("\nQuale preset vuoi eseguire?")
+        for i, p in enumerate(presets):
+            mod_sim = " [SIMULAZIONE]" if simulazione else ""
+            print(f"{i + 1}. {p['titolo']}{mod_sim}")
+        try:
+            sel = int(input("Scelta (0 per annullare): ")) - 1
+            if sel == -1: return
+            preset = presets[sel]
+            preset_index = sel
+        except (ValueError, IndexError): return
+    else:
+        preset = presets[preset_index]
+
+    stampa_dettaglio_esteso(preset)
+    tipo_run = "SIMULAZIONE" if simulazione else "BACKUP REALE"
+    print(f"Stai per lanciare: {tipo_run}")
+    if input("Vuoi procedere? (s/n): ").lower() != 's': return
+
+    preset_machine = preset.get("machine_id", "Sconosciuto")
+    if preset_machine != current_machine and not simulazione:
+        print(f"\nATTENZIONE: ID Macchina non corrispondente ({preset_machine}).")
+        if input("Scrivi 'SI' per forzare: ") != "SI": return
+
+    # --- CONTROLLO ESISTENZA ORIGINI ---
+    cartelle_valide = _cartelle_valide(preset)
+    if not cartelle_valide:
+        print("Nessuna cartella valida da copiare.")
+        return
+
+    if not simulazione and preset["ultimo_backup"]:
+        try:
+            d = datetime.datetime.strptime(preset["ultimo_backup"], "%Y-%m-%d").date()
+            if (datetime.date.today() - d).days < preset["giorni_periodicita"]:
+                print("AVVISO: Periodicità non ancora scaduta.")
+                if input("Procedere comunque? (s/n): ").lower() != 's': return
+        except: pass
+
+    spegni_pc = False
+    if not simulazione:
+        spegni_pc = (input("\nVuoi spegnere il PC al termine? (s/n): ").lower() == 's')
+
+    # --- ESECUZIONE ---
+    print(f"\n--- Esecuzione {tipo_run} ---")
+    riepilogo = _esegui_preset(preset, cartelle_valide, simulazione)
+    print("\n" + "="*60) 
+
+    # ============================================================
+    # REPORT FINALE (COMPARATIVO)
+    # ============================================================
+    precedente = _aggiorna_storico(preset, riepilogo, simulazione)
+    if not simulazione: save_settings(settings)
+    _stampa_report_sessione(tipo_run, riepilogo, precedente)
+    _fine_sessione(spegni_pc, [riepilogo["log_dir"]])
+
+def esegui_coda_backup(indici):
+    """
+    Coda non presidiata dei backup scaduti: una sola conferma, una sola domanda
+    di spegnimento, esecuzione in parallelo dei preset che scrivono su
+    destinazioni diverse (in sequenza quelli sulla stessa) e report consolidato.
+    """
+    settings = load_settings()
+    if settings is None: return
+    presets = settings["presets"]
+    coda = [presets[i] for i in indici if 0 <= i < len(presets)]
+    if not coda: return
+
+    # --- PREPARAZIONE (unica fase interattiva) ---
+    gruppi = {}
+    cartelle = {}
+    print("\n" + "="*60)
+    print(f"CODA BACKUP SCADUTI ({len(coda)} preset)")
+    print("="*60)
+    for p in coda:
+        print(f"- {p['titolo']} -> {p['root_destinazione']}")
+        valide = _cartelle_valide(p)
+        if not valide:
+            print("  AVVISO: nessuna cartella valida, preset saltato.")
+            continue
+        cartelle[id(p)] = valide
+        gruppi.setdefault(_chiave_destinazione(p), []).append(p)
+    if not gruppi:
+        print("Nessuna cartella valida da copiare.")
+        return
+    print("-" * 60)
+    modo = "in parallelo" if len(gruppi) > 1 else "in sequenza"
+    print(f"Destinazioni distinte: {len(gruppi)} (esecuzione {modo})")
+    if input("Vuoi eseguire ora i backup scaduti per QUESTA macchina? (s/n): ").lower() != 's': return
+    spegni_pc = (input("\nVuoi spegnere il PC al termine della coda? (s/n): ").lower() == 's')
+
+    # --- ESECUZIONE ---
+    print(f"\n--- Esecuzione CODA BACKUP ---")
+    start_coda = time.time()
+    risultati = {}
+    console_lock = threading.Lock() if len(gruppi) > 1 else None
+
+    def _esegui_gruppo(gruppo):
+        for p in gruppo:
+            if console_lock is None: print(f"\n>>> {p['titolo']}")
+            try:
+                risultati[id(p)] = _esegui_preset(p, cartelle[id(p)], False, console_lock)
+            except Exception as e:
+                risultati[id(p)] = e
+
+    if console_lock is None:
+        for gruppo in gruppi.values(): _esegui_gruppo(gruppo)
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(gruppi)) as pool:
+            list(pool.map(_esegui_gruppo, gruppi.values()))
+    durata_coda = time.time() - start_coda
+
+    # --- REPORT CONSOLIDATO ---
+    tot = {"files_copied": 0, "bytes_copied": 0, "files_failed": 0, "files_skipped": 0}
+    righe = []
+    errori = []
+    log_dirs = []
+    for p in coda:
+        r = risultati.get(id(p))
+        if r is None:
+            righe.append((p["titolo"], "SALTATO", "", "", "", ""))
+        elif isinstance(r, Exception):
+            righe.append((p["titolo"], "ERRORE", "", "", "", ""))
+            errori.append(f"{p['titolo']}: {r}")
+        else:
+            _aggiorna_storico(p, r, False)
+            for k in tot: tot[k] += r[k]
+            log_dirs.append(r["log_dir"])
+            errori.extend(f"{p['titolo']}: {e}" for e in r["errori"])
+            esito = "ERRORE" if r["errori"] else ("OK" if r["files_failed"] == 0 else "FALLITI")
+            m, s = divmod(int(r["durata"]), 60)
+            righe.append((p["titolo"], esito, str(r["files_copied"]), format_size(r["bytes_copied"]),
+                          str(r["files_failed"]), f"{m:02d}:{s:02d}"))
+    save_settings(settings)
+
+    print("\n" + "="*60)
+    print("RIEPILOGO CODA - BACKUP REALE")
+    print("="*60)
+    print(f"Tempo Totale:     {_formatta_durata(durata_coda)}")
+    print("-" * 60)
+    print(f"{'PRESET':<18} {'ESITO':<8} {'COPIATI':<8} {'DATI':<12} {'FALLITI':<8} {'TEMPO'}")
+    print("-" * 60)
+    for titolo, esito, copiati, dati, falliti, tempo in righe:
+        titolo = (titolo[:16] + '..') if len(titolo) > 18 else titolo
+        print(f"{titolo:<18} {esito:<8} {copiati:<8} {dati:<12} {falliti:<8} {tempo}")
+    print("-" * 60)
+    speed_str = "0.00 B/s"
+    if durata_coda > 0 and tot["bytes_copied"] > 0:
+        speed_str = f"{format_size(tot['bytes_copied'] / durata_coda)}/s"
+    print(f"File Copiati:    {str(tot['files_copied']):<10} ({format_size(tot['bytes_copied'])})")
+    print(f"File Invariati:  {str(tot['files_skipped']):<10} (Saltati)")
+    print(f"File Falliti:    {str(tot['files_failed']):<10}")
+    print(f"Velocità Media:  {speed_str}")
+    for p in coda:
+        r = risultati.get(id(p))
+        if isinstance(r, dict): _stampa_controllo(r, p["titolo"])
+
+    if tot["files_failed"] > 0 or errori:
+        print("\n" + "!"*60)
+        for e in errori: print(f" ERRORE PRESET {e}")
+        print(f" ATTENZIONE: {tot['files_failed']} file NON sono stati copiati per errore.")
+        print(" CONTROLLARE I LOG NELLE CARTELLE DI DESTINAZIONE!")
+        print("!"*60)
+    print("="*60)
+
+    _fine_sessione(spegni_pc, log_dirs)
 # --- FUNZIONI DI MENU ---
 
 def crea_nuovo_preset():
@@ -541,7 +1104,9 @@ def modifica_preset():
         print("4. Aggiungi ESCLUSIONE")
         print("5. Rimuovi ESCLUSIONE")
         print("6. Adotta su questa macchina")
-        print("7. Indietro")
+        print("7. Configura AGENTE destinazione")
+        print("8. Prestazioni (concorrenza adattiva, limite di banda)")
+        print("9. Indietro")
         s = input("Scelta: ")
         
         if s == '1':
@@ -624,8 +1189,62 @@ def modifica_preset():
             preset["machine_id"] = get_machine_id()
             save_settings(settings)
             print("Adottato.")
+
+        elif s == '7':
+            agente = preset.get("agente") or {}
+            print("L'agente (scriba_agent.py) deve girare sulla destinazione con --root uguale alla Root Destinazione.")
+            host = input(f"Host agente [{agente.get('host', '')}] ('-' per disattivare): ").strip()
+            if host == '-':
+                preset["agente"] = None
+                save_settings(settings)
+                print("Agente disattivato: verrà usato Robocopy.")
+                continue
+            host = host or agente.get("host", "")
+            if not host: continue
+            try:
+                porta = int(input(f"Porta [{agente.get('porta', scriba_agent.PORTA_DEFAULT)}]: ") or agente.get("porta", scriba_agent.PORTA_DEFAULT))
+            except ValueError: continue
+            token = input("Token (invio per mantenere): ").strip() or agente.get("token", "")
+            preset["agente"] = {"host": host, "porta": porta, "token": token}
+            save_settings(settings)
+            try:
+                with scriba_agent.ClientAgente(host, porta, token, timeout=5) as c:
+                    print(f"Agente raggiungibile. Root: {c.ping()['root']}")
+            except (OSError, scriba_agent.ErroreAgente) as e:
+                print(f"AVVISO: Agente non raggiungibile ora ({e}). Configurazione salvata comunque.")
             
-        elif s == '7': break
+        elif s == '8':
+            prest = dict(PRESTAZIONI_DEFAULT, **(preset.get("prestazioni") or {}))
+            stato = "s" if prest["adattivo"] else "n"
+            scelta = input(f"Concorrenza adattiva (AIMD)? (s/n) [{stato}]: ").strip().lower() or stato
+            prest["adattivo"] = (scelta == 's')
+            try:
+                v = input(f"Copie in volo massime [{prest['concorrenza_max']}]: ").strip()
+                if v: prest["concorrenza_max"] = max(1, min(int(v), engine.CONCORRENZA_MAX))
+                v = input(f"Limite di banda in Mbit/s, 0 = nessuno [{prest['limite_banda_mbps']}]: ").strip()
+                if v: prest["limite_banda_mbps"] = max(0, float(v))
+                v = input(f"Soglia copia multi-flusso in MB, 0 = disattivata [{prest['multiflusso_soglia_mb']}]: ").strip()
+                if v: prest["multiflusso_soglia_mb"] = max(0, int(v))
+                v = input(f"Flussi per file grande, 0 = automatico [{prest['multiflusso_flussi']}]: ").strip()
+                if v: prest["multiflusso_flussi"] = max(0, min(int(v), engine.CONCORRENZA_MAX))
+                if prest["multiflusso_soglia_mb"]:
+                    stato = "s" if prest["multiflusso_verifica"] else "n"
+                    scelta = input(f"Rileggere la destinazione per verificarla (traffico doppio)? (s/n) [{stato}]: ").strip().lower() or stato
+                    prest["multiflusso_verifica"] = (scelta == 's')
+                if prest["limite_banda_mbps"]:
+                    for chiave, etichetta in (("limite_dalle", "Limite attivo dalle"), ("limite_alle", "Limite attivo alle")):
+                        v = input(f"{etichetta} (HH:MM) [{prest[chiave]}]: ").strip()
+                        if v:
+                            datetime.datetime.strptime(v, "%H:%M")
+                            prest[chiave] = v
+            except ValueError:
+                print("Valore non valido, modifiche annullate.")
+                continue
+            preset["prestazioni"] = prest
+            save_settings(settings)
+            print("Prestazioni aggiornate.")
+
+        elif s == '9': break
 def elimina_preset():
     settings = load_settings()
     if not settings or not settings["presets"]: return
@@ -726,10 +1345,8 @@ def check_scadenze_avvio():
 
     # --- FASE 3: Azione ---
     if indici_scaduti_locali:
-        # Chiediamo di eseguire solo se ci sono scadenze LOCALI
-        if input("Vuoi eseguire ora i backup scaduti per QUESTA macchina? (s/n): ").lower() == 's':
-            for i in indici_scaduti_locali:
-                esegui_backup(i)
+        # Solo se ci sono scadenze LOCALI: la coda mostra il riepilogo e chiede conferma una volta
+        esegui_coda_backup(indici_scaduti_locali)
     else:
         # Se tutto è a posto localmente, un breve delay per far leggere il report
         time.sleep(1)
@@ -0,0 +1,407 @@
+# Scriba by Gabriele Battaglia (IZ4APU)
+# Agente di destinazione: gira sulla macchina che ospita i backup e serve
+# elenchi, stat, hash e scritture in blocco via TCP, evitando le migliaia di
+# round-trip SMB che Scriba farebbe file per file.
+#
+# Avvio sulla destinazione:
+#   python scriba_agent.py --root D:\Backups\PC_Gigante --porta 7878 --token segreto
+#
+# Protocollo: ogni messaggio è un header JSON preceduto dalla sua lunghezza
+# (4 byte big-endian). Se l'header contiene "payload": n, seguono n byte grezzi.
+# NB: il token autentica ma NON cifra il traffico; usare solo su rete fidata.
+# Senza token l'agente accetta solo connessioni locali (127.0.0.1).
+
+import os
+import sys
+import json
+import shutil
+import struct
+import socket
+import hashlib
+import hmac
+import time
+import argparse
+import socketserver
+from array import array
+
+import scriba_engine as engine
+
+PORTA_DEFAULT = 7878
+TIMEOUT_SOCKET = 60.0
+INTERVALLO_FRAME = 5.0
+BLOCCO_IO = 1024 * 1024
+VOCI_PER_FRAME = 20000
+LOTTO_MAX_BYTES = 8 * 1024 * 1024
+LOTTO_MAX_FILE = 256
+LOTTO_MAX_COMANDI = 1000
+DIM_DIGEST = 64
+SUFFISSO_TMP = ".scriba_tmp"
+ESITO_OK = b"\x01"
+ESITO_ANNULLATO = b"\x00"
+HOST_LOCALI = ("127.0.0.1", "localhost", "::1")
+
+class ErroreAgente(Exception):
+    pass
+
+# --- FRAMING ---
+
+def _ricevi_esatti(sock, n):
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(min(n - len(buf), BLOCCO_IO))
+        if not chunk: raise ConnectionError("Connessione chiusa dal peer.")
+        buf += chunk
+    return bytes(buf)
+
+# surrogatepass: nomi non UTF-8 (NAS Linux) o surrogati isolati (Windows) viaggiano intatti
+def invia_msg(sock, header):
+    dati = json.dumps(header, ensure_ascii=False).encode('utf-8', 'surrogatepass')
+    sock.sendall(struct.pack(">I", len(dati)) + dati)
+
+def ricevi_header(sock):
+    (n,) = struct.unpack(">I", _ricevi_esatti(sock, 4))
+    return json.loads(_ricevi_esatti(sock, n).decode('utf-8', 'surrogatepass'))
+
+def hash_file(path):
+    h = hashlib.blake2b()
+    with open(path, 'rb') as f:
+        while True:
+            b = f.read(BLOCCO_IO)
+            if not b: break
+            h.update(b)
+    return h.hexdigest()
+
+# --- SERVER ---
+
+class _GestoreAgente(socketserver.BaseRequestHandler):
+
+    def _risolvi(self, rel):
+        """Percorso assoluto sotto la root dell'agente; rifiuta ogni uscita dalla root."""
+        root = self.server.root
+        if os.path.isabs(rel) or os.path.splitdrive(rel)[0]:
+            raise ErroreAgente(f"Percorso assoluto non ammesso: {rel}")
+        path = os.path.realpath(os.path.join(root, rel))
+        if os.path.commonpath([root, path]) != root:
+            raise ErroreAgente(f"Percorso fuori dalla root: {rel}")
+        return path
+
+    def handle(self):
+        sock = self.request
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        try:
+            while True:
+                # Nessun timeout tra una richiesta e l'altra: il client può scansionare
+                # l'origine per minuti; le connessioni morte le chiude il keepalive
+                sock.settimeout(None)
+                try:
+                    header = ricevi_header(sock)
+                except (ConnectionError, struct.error, ValueError):
+                    return
+                sock.settimeout(TIMEOUT_SOCKET)
+                token = str(header.get("token", "")).encode('utf-8')
+                if not hmac.compare_digest(token, self.server.token.encode('utf-8')):
+                    invia_msg(sock, {"ok": False, "errore": "Token non valido."})
+                    return
+                cmd = header.get("cmd")
+                gestore = getattr(self, f"_cmd_{cmd}", None)
+                try:
+                    if gestore is None: raise ErroreAgente(f"Comando sconosciuto: {cmd}")
+                    gestore(sock, header)
+                except (ErroreAgente, OSError, ValueError) as e:
+                    invia_msg(sock, {"ok": False, "errore": str(e)})
+        except (ConnectionError, socket.timeout, OSError):
+            pass
+
+    def _cmd_ping(self, sock, header):
+        invia_msg(sock, {"ok": True, "root": self.server.root})
+
+    def _cmd_lista(self, sock, header):
+        # L'albero viene inviato in ordine di indice durante la scansione: il client
+        # lo ricostruisce identico e riceve un frame almeno ogni INTERVALLO_FRAME secondi
+        base = self._risolvi(header.get("path", ""))
+        excl = [self._risolvi(os.path.join(header.get("path", ""), e)) for e in header.get("esclusioni", [])]
+        voci = []
+        ultimo_invio = [time.monotonic()]
+
+        def _al_gruppo(albero, parent, primo):
+            if primo >= 0:
+                for i in range(primo, primo + albero.num_figli[parent]):
+                    voci.append([parent, albero.nome(i), albero.is_dir(i), albero.size[i], albero.mtime_ns[i]])
+            if len(voci) >= VOCI_PER_FRAME or time.monotonic() - ultimo_invio[0] >= INTERVALLO_FRAME:
+                invia_msg(sock, {"ok": True, "voci": voci, "fine": False})
+                voci.clear()
+                ultimo_invio[0] = time.monotonic()
+
+        albero = engine.scansiona_albero(base, esclusioni_dir=excl, al_gruppo=_al_gruppo)
+        invia_msg(sock, {"ok": True, "voci": voci, "fine": True, "errori": albero.errori})
+
+    def _cmd_stat(self, sock, header):
+        risultati = []
+        for rel in header.get("paths", []):
+            try:
+                st = os.stat(self._risolvi(rel))
+                risultati.append([st.st_size, st.st_mtime_ns])
+            except (OSError, ErroreAgente):
+                risultati.append(None)
+        invia_msg(sock, {"ok": True, "stat": risultati})
+
+    def _cmd_hash(self, sock, header):
+        risultati = []
+        for rel in header.get("paths", []):
+            try: risultati.append(hash_file(self._risolvi(rel)))
+            except (OSError, ErroreAgente): risultati.append(None)
+        invia_msg(sock, {"ok": True, "hash": risultati})
+
+    def _cmd_crea_dir(self, sock, header):
+        errori = []
+        for rel in header.get("paths", []):
+            try: os.makedirs(self._risolvi(rel), exist_ok=True)
+            except (OSError, ErroreAgente) as e: errori.append([rel, str(e)])
+        invia_msg(sock, {"ok": True, "errori": errori})
+
+    def _cmd_elimina(self, sock, header):
+        errori = []
+        for rel in header.get("paths", []):
+            try:
+                path = self._risolvi(rel)
+                if path == self.server.root: raise ErroreAgente("Impossibile eliminare la root.")
+                if os.path.isdir(path) and not os.path.islink(path): shutil.rmtree(path)
+                elif os.path.lexists(path): os.remove(path)
+            except (OSError, ErroreAgente) as e: errori.append([rel, str(e)])
+        invia_msg(sock, {"ok": True, "errori": errori})
+
+    def _cmd_scrivi(self, sock, header):
+        """
+        Scrittura in blocco: header["file"] = [[rel, size, mtime_ns], ...],
+        payload = per ogni file, contenuto + 1 byte di esito (ESITO_OK / ESITO_ANNULLATO)
+        + digest BLAKE2b del client (DIM_DIGEST byte).
+        Ogni file passa da un temporaneo e viene rinominato solo se completo, confermato
+        e con digest identico a quello calcolato sui byte ricevuti.
+        """
+        risultati = []
+        for rel, size, mtime_ns in header.get("file", []):
+            # Il payload va consumato comunque, anche se la scrittura fallisce
+            try:
+                path = self._risolvi(rel)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                f = open(path + SUFFISSO_TMP, 'wb')
+            except (OSError, ErroreAgente) as e:
+                self._scarta(sock, size + 1 + DIM_DIGEST)
+                risultati.append({"ok": False, "errore": str(e)})
+                continue
+            h = hashlib.blake2b()
+            errore = None
+            with f:
+                resto = size
+                while resto > 0:
+                    b = _ricevi_esatti(sock, min(resto, BLOCCO_IO))
+                    resto -= len(b)
+                    h.update(b)
+                    if errore is None:
+                        try: f.write(b)
+                        except OSError as e: errore = str(e)
+            esito = _ricevi_esatti(sock, 1)
+            digest_client = _ricevi_esatti(sock, DIM_DIGEST)
+            if esito != ESITO_OK and errore is None:
+                errore = "Invio annullato dal client (file modificato durante la copia)."
+            if errore is None and not hmac.compare_digest(digest_client, h.digest()):
+                errore = "Hash non corrispondente."
+            try:
+                if errore is not None: raise OSError(errore)
+                os.replace(path + SUFFISSO_TMP, path)
+                os.utime(path, ns=(mtime_ns, mtime_ns))
+                risultati.append({"ok": True, "hash": h.hexdigest()})
+            except OSError as e:
+                try: os.remove(path + SUFFISSO_TMP)
+                except OSError: pass
+                risultati.append({"ok": False, "errore": str(e)})
+        invia_msg(sock, {"ok": True, "risultati": risultati})
+
+    def _scarta(self, sock, n):
+        while n > 0:
+            n -= len(_ricevi_esatti(sock, min(n, BLOCCO_IO)))
+
+
+class ServerAgente(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, root, host="127.0.0.1", porta=PORTA_DEFAULT, token=""):
+        if not token and host not in HOST_LOCALI:
+            raise ErroreAgente(f"Token obbligatorio per ascoltare su {host}.")
+        self.root = os.path.realpath(root)
+        self.token = token or ""
+        super().__init__((host, porta), _GestoreAgente)
+
+# --- CLIENT ---
+
+class ClientAgente:
+    """
+    Connessione a uno scriba_agent. I percorsi sono relativi alla root dell'agente.
+    Configurazione nel preset: "agente": {"host": ..., "porta": ..., "token": ...}
+    """
+
+    def __init__(self, host, porta=PORTA_DEFAULT, token="", timeout=TIMEOUT_SOCKET):
+        self.token = token or ""
+        self._indirizzo = (host, porta)
+        self._timeout = timeout
+        self.sock = None
+        self.riconnetti()
+
+    def riconnetti(self):
+        """Apre (o riapre, dopo un errore di rete) la connessione all'agente."""
+        self.chiudi()
+        self.sock = socket.create_connection(self._indirizzo, timeout=self._timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+    @classmethod
+    def da_preset(cls, conf):
+        return cls(conf["host"], int(conf.get("porta", PORTA_DEFAULT)), conf.get("token", ""))
+
+    def chiudi(self):
+        if self.sock is None: return
+        try: self.sock.close()
+        except OSError: pass
+        self.sock = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.chiudi()
+
+    def _richiesta(self, header):
+        invia_msg(self.sock, dict(header, token=self.token))
+        risposta = ricevi_header(self.sock)
+        if not risposta.get("ok"): raise ErroreAgente(risposta.get("errore", "Errore sconosciuto."))
+        return risposta
+
+    def ping(self):
+        return self._richiesta({"cmd": "ping"})
+
+    def lista(self, path="", esclusioni=()):
+        """Elenco remoto di path come AlberoCompatto (ricevuto a blocchi)."""
+        invia_msg(self.sock, {"cmd": "lista", "path": path, "esclusioni": list(esclusioni), "token": self.token})
+        albero = engine.AlberoCompatto()
+        # Indice server -> indice locale: l'ordinamento locale (normcase) può
+        # differire da quello dell'agente se i sistemi operativi sono diversi
+        mappa = array('i', [0])
+        gruppo, parent_gruppo = [], 0
+
+        def _chiudi_gruppo():
+            primo = albero.aggiungi_figli(mappa[parent_gruppo], gruppo)
+            ordine = sorted(range(len(gruppo)), key=lambda k: os.path.normcase(gruppo[k][0]))
+            locali = [0] * len(gruppo)
+            for pos, k in enumerate(ordine): locali[k] = primo + pos
+            mappa.extend(locali)
+
+        while True:
+            risposta = ricevi_header(self.sock)
+            if not risposta.get("ok"): raise ErroreAgente(risposta.get("errore", "Errore sconosciuto."))
+            for parent, nome, is_dir, size, mtime_ns in risposta["voci"]:
+                # I figli di ogni cartella arrivano contigui: si aggiungono a gruppi
+                if parent != parent_gruppo and gruppo:
+                    _chiudi_gruppo()
+                    gruppo = []
+                parent_gruppo = parent
+                gruppo.append((nome, is_dir, size, mtime_ns))
+            if risposta.get("fine"):
+                if gruppo: _chiudi_gruppo()
+                albero.errori = risposta.get("errori", 0)
+                return albero.congela()
+
+    def stat(self, paths):
+        return self._richiesta({"cmd": "stat", "paths": list(paths)})["stat"]
+
+    def hash(self, paths):
+        return self._richiesta({"cmd": "hash", "paths": list(paths)})["hash"]
+
+    def crea_dir(self, paths):
+        return self._richiesta({"cmd": "crea_dir", "paths": list(paths)})["errori"]
+
+    def elimina(self, paths):
+        return self._richiesta({"cmd": "elimina", "paths": list(paths)})["errori"]
+
+    def scrivi(self, file_locali, limitatore=None):
+        """
+        Invia un lotto di file: file_locali = [(path_locale, rel_remoto), ...].
+        Restituisce, per ogni file, (ok, errore). Il digest viaggia dopo ogni file:
+        l'agente rinomina il temporaneo solo se coincide con quello che ha ricevuto.
+        limitatore: LimitatoreBanda opzionale per il tetto di banda.
+        """
+        # Tutti i file si aprono prima di inviare l'header: un errore qui non sporca il flusso
+        voci, aperti, hash_locali = [], [], []
+        try:
+            for path, rel in file_locali:
+                f = open(path, 'rb')
+                aperti.append(f)
+                st = os.fstat(f.fileno())
+                voci.append([rel, st.st_size, st.st_mtime_ns])
+            invia_msg(self.sock, {"cmd": "scrivi", "file": voci,
+                                  "payload": sum(v[1] + 1 + DIM_DIGEST for v in voci), "token": self.token})
+            for f, (_, size, _) in zip(aperti, voci):
+                h = hashlib.blake2b()
+                inviati = 0
+                while inviati < size:
+                    try: b = f.read(min(BLOCCO_IO, size - inviati))
+                    except OSError: b = b""
+                    if not b: break
+                    h.update(b)
+                    if limitatore: limitatore.consuma(len(b))
+                    self.sock.sendall(b)
+                    inviati += len(b)
+                if inviati < size:
+                    # File accorciato o illeggibile durante l'invio: si completa il frame e l'agente lo scarta
+                    self.sock.sendall(b"\0" * (size - inviati) + ESITO_ANNULLATO + b"\0" * DIM_DIGEST)
+                    hash_locali.append(None)
+                else:
+                    self.sock.sendall(ESITO_OK + h.digest())
+                    hash_locali.append(h.hexdigest())
+        finally:
+            for f in aperti: f.close()
+        risposta = ricevi_header(self.sock)
+        if not risposta.get("ok"): raise ErroreAgente(risposta.get("errore", "Errore sconosciuto."))
+        esiti = []
+        for r, h_loc in zip(risposta["risultati"], hash_locali):
+            if not r.get("ok"): esiti.append((False, r.get("errore")))
+            elif h_loc is None: esiti.append((False, "File modificato durante la copia."))
+            elif r.get("hash") != h_loc: esiti.append((False, "Hash non corrispondente."))
+            else: esiti.append((True, None))
+        return esiti
+
+
+def lotti_scrittura(file_locali):
+    """Raggruppa (path_locale, rel_remoto, size) in lotti per limitare i round-trip."""
+    lotto, byte_lotto = [], 0
+    for path, rel, size in file_locali:
+        if lotto and (byte_lotto + size > LOTTO_MAX_BYTES or len(lotto) >= LOTTO_MAX_FILE):
+            yield lotto
+            lotto, byte_lotto = [], 0
+        lotto.append((path, rel, size))
+        byte_lotto += size
+    if lotto: yield lotto
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scriba - agente di destinazione")
+    parser.add_argument("--root", required=True, help="Cartella servita (root destinazione del preset)")
+    parser.add_argument("--host", default="127.0.0.1", help="Usare 0.0.0.0 per la rete (richiede --token)")
+    parser.add_argument("--porta", type=int, default=PORTA_DEFAULT)
+    parser.add_argument("--token", default="")
+    args = parser.parse_args()
+    if not os.path.isdir(args.root):
+        print(f"ERRORE: root non trovata: {args.root}")
+        sys.exit(1)
+    try:
+        server = ServerAgente(args.root, args.host, args.porta, args.token)
+    except ErroreAgente as e:
+        print(f"ERRORE: {e}")
+        sys.exit(1)
+    with server:
+        print(f"Scriba Agent in ascolto su {args.host}:{args.porta} - root: {server.root}")
+        try: server.serve_forever()
+        except KeyboardInterrupt: print("\nAgente arrestato.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,463 @@
+# Scriba by Gabriele Battaglia (IZ4APU)
+# Motore nativo: strutture dati e operazioni che non passano da Robocopy.
+# Il modulo non dipende da wxPython, così può essere usato anche dai
+# benchmark e dagli script di servizio.
+
+import os
+import stat
+import time
+import shutil
+import hashlib
+import datetime
+import threading
+import concurrent.futures
+from array import array
+
+# --- COSTANTI ---
+# Tolleranza sui timestamp equivalente a /FFT di Robocopy (2 secondi, FAT)
+MTIME_TOLLERANZA_NS = 2_000_000_000
+
+# Esclusioni GLOBALI, le stesse passate a Robocopy
+ESCLUSIONI_DIR_GLOBALI = ("$RECYCLE.BIN", "System Volume Information")
+ESCLUSIONI_FILE_GLOBALI = ("pagefile.sys", "hiberfil.sys", "swapfile.sys")
+
+# Azioni prodotte dal confronto tra alberi
+DIFF_NUOVO = "nuovo"            # presente solo in origine
+DIFF_MODIFICATO = "modificato"  # presente in entrambi ma diverso
+DIFF_EXTRA = "extra"            # presente solo in destinazione (da eliminare)
+
+_FLAG_DIR = 1
+
+# --- ALBERO COMPATTO ---
+
+class AlberoCompatto:
+    """
+    Tabella dei file di un albero in forma compatta.
+    Ogni voce occupa poche decine di byte: i nomi stanno in un unico blob UTF-8
+    (quelli delle cartelle internati) e tutti gli attributi vivono in array tipizzati.
+    I figli di ogni cartella sono contigui e ordinati, così due alberi si
+    confrontano con un merge in streaming senza costruire percorsi completi.
+    """
+
+    def __init__(self):
+        # Nomi internati: blob UTF-8 + offset di inizio di ciascun nome
+        self._blob = bytearray()
+        self._offset_nomi = array('q', [0])
+        self._intern = {}
+        # Attributi per voce (indice = id voce, la 0 è la radice)
+        self.parent = array('i', [-1])
+        self.nome_id = array('i', [self._interna("")])
+        self.size = array('q', [0])
+        self.mtime_ns = array('q', [0])
+        self.primo_figlio = array('i', [-1])
+        self.num_figli = array('i', [0])
+        self.flags = bytearray([_FLAG_DIR])
+        self.errori = 0
+
+    def __len__(self):
+        return len(self.parent)
+
+    def _interna(self, nome, condiviso=True):
+        # Solo i nomi di cartella (CD1, Artwork, ...) si ripetono abbastanza da
+        # valere un dizionario: i nomi dei file vanno dritti nel blob, così anche
+        # il picco in costruzione resta di poche decine di byte per voce
+        nid = self._intern.get(nome) if condiviso else None
+        if nid is None:
+            nid = len(self._offset_nomi) - 1
+            self._blob += nome.encode('utf-8', 'surrogatepass')
+            self._offset_nomi.append(len(self._blob))
+            if condiviso: self._intern[nome] = nid
+        return nid
+
+    def aggiungi_figli(self, parent, voci):
+        """
+        Aggiunge tutti i figli di una cartella in un colpo solo.
+        voci: iterabile di (nome, is_dir, size, mtime_ns).
+        Restituisce l'indice del primo figlio (-1 se nessuno).
+        """
+        if self._intern is None:
+            raise RuntimeError("Albero congelato: impossibile aggiungere voci.")
+        voci = sorted(voci, key=lambda v: os.path.normcase(v[0]))
+        if not voci: return -1
+        primo = len(self.parent)
+        for nome, is_dir, size, mtime_ns in voci:
+            self.parent.append(parent)
+            self.nome_id.append(self._interna(nome, is_dir))
+            self.size.append(size)
+            self.mtime_ns.append(mtime_ns)
+            self.primo_figlio.append(-1)
+            self.num_figli.append(0)
+            self.flags.append(_FLAG_DIR if is_dir else 0)
+        self.primo_figlio[parent] = primo
+        self.num_figli[parent] = len(voci)
+        return primo
+
+    def congela(self):
+        """Libera il dizionario di internamento: da qui l'albero è in sola lettura."""
+        self._intern = None
+        return self
+
+    def nome(self, idx):
+        nid = self.nome_id[idx]
+        return self._blob[self._offset_nomi[nid]:self._offset_nomi[nid + 1]].decode('utf-8', 'surrogatepass')
+
+    def is_dir(self, idx):
+        return bool(self.flags[idx] & _FLAG_DIR)
+
+    def figli(self, idx):
+        primo = self.primo_figlio[idx]
+        if primo < 0: return range(0)
+        return range(primo, primo + self.num_figli[idx])
+
+    def percorso(self, idx, sep=os.sep):
+        """Percorso relativo alla radice, ricostruito risalendo i parent."""
+        parti = []
+        while idx > 0:
+            parti.append(self.nome(idx))
+            idx = self.parent[idx]
+        return sep.join(reversed(parti))
+
+    def discendenti(self, idx):
+        """Tutte le voci sotto idx (esclusa idx stessa), in ordine di visita."""
+        stack = [idx]
+        while stack:
+            for f in self.figli(stack.pop()):
+                yield f
+                if self.flags[f] & _FLAG_DIR: stack.append(f)
+
+    def num_file(self):
+        return sum(1 for f in self.flags if not f & _FLAG_DIR)
+
+    def byte_totali(self):
+        return sum(self.size)
+
+    def memoria_bytes(self):
+        """Occupazione dei buffer (esclusi i dizionari temporanei di costruzione)."""
+        tot = len(self._blob)
+        for a in (self._offset_nomi, self.parent, self.nome_id, self.size,
+                  self.mtime_ns, self.primo_figlio, self.num_figli):
+            tot += a.buffer_info()[1] * a.itemsize
+        return tot + len(self.flags)
+
+
+def scansiona_albero(root, esclusioni_dir=(), esclusioni_file=(), al_gruppo=None):
+    """
+    Costruisce un AlberoCompatto leggendo il disco in ampiezza (os.scandir).
+    Salta symlink e junction (come /XJ), le esclusioni globali e quelle utente.
+    Le esclusioni utente possono essere nomi o percorsi completi.
+    al_gruppo(albero, parent, primo): richiamata dopo ogni cartella letta, per
+    chi vuole trasmettere l'albero mentre la scansione è ancora in corso.
+    """
+    albero = AlberoCompatto()
+    excl_nomi_dir = {os.path.normcase(e) for e in ESCLUSIONI_DIR_GLOBALI}
+    excl_percorsi = set()
+    for e in esclusioni_dir:
+        if os.sep in e or "/" in e: excl_percorsi.add(os.path.normcase(os.path.abspath(e)))
+        else: excl_nomi_dir.add(os.path.normcase(e))
+    excl_file = {os.path.normcase(e) for e in ESCLUSIONI_FILE_GLOBALI}
+    excl_file.update(os.path.normcase(e) for e in esclusioni_file)
+
+    # Le cartelle da visitare sono quelle già inserite: basta scorrere gli indici
+    dir_path = {0: root}
+    idx = 0
+    while idx < len(albero):
+        if not albero.is_dir(idx):
+            idx += 1
+            continue
+        path = dir_path.pop(idx)
+        # Esclusioni ROOT-ONLY (Nomi generici)
+        excl_root = set()
+        if idx == 0:
+            drive, tail = os.path.splitdrive(root)
+            if tail in ['\\', '/', ''] or root.endswith(':\\'): excl_root.add(os.path.normcase("Recovery"))
+        voci = []
+        try:
+            with os.scandir(path) as it:
+                for e in it:
+                    try:
+                        if e.is_symlink(): continue
+                        is_dir = e.is_dir(follow_symlinks=False)
+                        nome_nc = os.path.normcase(e.name)
+                        if is_dir:
+                            # Junction (come /XJ): fino a Python 3.11 non risultano symlink
+                            attr = getattr(e.stat(follow_symlinks=False), "st_file_attributes", 0)
+                            if attr & stat.FILE_ATTRIBUTE_REPARSE_POINT: continue
+                            if nome_nc in excl_nomi_dir or nome_nc in excl_root: continue
+                            if excl_percorsi and os.path.normcase(os.path.abspath(e.path)) in excl_percorsi: continue
+                            voci.append((e.name, True, 0, 0))
+                        else:
+                            if nome_nc in excl_file: continue
+                            st = e.stat(follow_symlinks=False)
+                            voci.append((e.name, False, st.st_size, st.st_mtime_ns))
+                    except OSError:
+                        albero.errori += 1
+        except OSError:
+            albero.errori += 1
+        primo = albero.aggiungi_figli(idx, voci)
+        if al_gruppo: al_gruppo(albero, idx, primo)
+        if primo >= 0:
+            for f in albero.figli(idx):
+                if albero.is_dir(f):
+                    dir_path[f] = os.path.join(path, albero.nome(f))
+        idx += 1
+    return albero.congela()
+
+
+def _voce_diversa(src, i, dst, j):
+    if src.size[i] != dst.size[j]: return True
+    return abs(src.mtime_ns[i] - dst.mtime_ns[j]) > MTIME_TOLLERANZA_NS
+
+
+def diff_alberi(src, dst):
+    """
+    Confronto in streaming tra albero di origine e di destinazione.
+    Genera tuple (azione, idx_src, idx_dst) con idx a -1 dove la voce manca.
+    Le cartelle nuove vengono seguite dal loro intero contenuto (da copiare),
+    mentre per le cartelle EXTRA viene emessa solo la cartella (eliminazione ricorsiva).
+    """
+    stack = [(0, 0)]
+    while stack:
+        ds, dd = stack.pop()
+        fs, fd = src.figli(ds), dst.figli(dd)
+        a, b = 0, 0
+        while a < len(fs) or b < len(fd):
+            i = fs[a] if a < len(fs) else -1
+            j = fd[b] if b < len(fd) else -1
+            ki = os.path.normcase(src.nome(i)) if i >= 0 else None
+            kj = os.path.normcase(dst.nome(j)) if j >= 0 else None
+            if j < 0 or (i >= 0 and ki < kj):
+                yield (DIFF_NUOVO, i, -1)
+                if src.is_dir(i):
+                    for k in src.discendenti(i): yield (DIFF_NUOVO, k, -1)
+                a += 1
+            elif i < 0 or kj < ki:
+                yield (DIFF_EXTRA, -1, j)
+                b += 1
+            else:
+                s_dir, d_dir = src.is_dir(i), dst.is_dir(j)
+                if s_dir and d_dir:
+                    stack.append((i, j))
+                elif s_dir != d_dir:
+                    # Tipo cambiato: si elimina la vecchia voce e si copia la nuova
+                    yield (DIFF_EXTRA, -1, j)
+                    yield (DIFF_NUOVO, i, -1)
+                    if s_dir:
+                        for k in src.discendenti(i): yield (DIFF_NUOVO, k, -1)
+                elif _voce_diversa(src, i, dst, j):
+                    yield (DIFF_MODIFICATO, i, j)
+                a += 1; b += 1
+
+# --- CONTROLLO ADATTIVO ---
+# AIMD come nel controllo di congestione TCP: +1 copia in volo finché il
+# throughput regge, dimezzamento quando crolla o compaiono errori.
+CONCORRENZA_MIN = 1
+CONCORRENZA_MAX = 32
+CONCORRENZA_INIZIALE = 4
+RETRY_BASE = 1          # equivalente di /R
+ATTESA_BASE = 1         # equivalente di /W (secondi)
+RETRY_MAX = 5
+ATTESA_MAX = 30
+SOGLIA_ERRORI = 0.01            # oltre l'1% di file falliti si rallenta
+SOGLIA_CALO_THROUGHPUT = 0.15   # calo oltre il 15% dopo un aumento = congestione
+CAMPIONE_MIN_BYTES = 64 * 1024 * 1024
+
+class ControlloreAdattivo:
+    """
+    Regola copie in volo e backoff dei tentativi tra un'esecuzione e la successiva,
+    in base a throughput e tasso di errore misurati. Le decisioni restano in
+    self.decisioni per il report e i log.
+    """
+
+    def __init__(self, concorrenza=CONCORRENZA_INIZIALE, concorrenza_max=CONCORRENZA_MAX):
+        self.concorrenza_max = max(CONCORRENZA_MIN, min(int(concorrenza_max), CONCORRENZA_MAX))
+        self.concorrenza = max(CONCORRENZA_MIN, min(int(concorrenza), self.concorrenza_max))
+        self.retry = RETRY_BASE
+        self.attesa = ATTESA_BASE
+        self.decisioni = []
+        self._ultimo_tp = None
+        self._ultima_azione = None
+
+    def parametri(self):
+        return {"concorrenza": self.concorrenza, "retry": self.retry, "attesa": self.attesa}
+
+    def registra(self, etichetta, byte, secondi, file_ok, file_falliti):
+        """
+        Registra una misura e decide i parametri del passo successivo.
+        secondi è il tempo di sola copia (None se ignoto: conta solo il tasso di errore),
+        perché il tempo di scansione dei file invariati falserebbe il throughput.
+        """
+        tp = byte / secondi if secondi else None
+        totale = file_ok + file_falliti
+        tasso_errori = file_falliti / totale if totale else 0.0
+        usata = self.concorrenza
+
+        if tasso_errori > SOGLIA_ERRORI:
+            azione, motivo = "riduzione", f"errori {tasso_errori:.1%}"
+            self.concorrenza = max(CONCORRENZA_MIN, self.concorrenza // 2)
+            self.retry = min(RETRY_MAX, self.retry + 1)
+            self.attesa = min(ATTESA_MAX, self.attesa * 2)
+        else:
+            # Nessun errore: il backoff torna gradualmente ai valori base
+            self.retry = max(RETRY_BASE, self.retry - 1)
+            self.attesa = max(ATTESA_BASE, self.attesa // 2)
+            if tp is None or byte < CAMPIONE_MIN_BYTES:
+                azione, motivo = "stabile", "campione insufficiente"
+            elif (self._ultimo_tp and self._ultima_azione == "aumento"
+                  and tp < self._ultimo_tp * (1 - SOGLIA_CALO_THROUGHPUT)):
+                azione, motivo = "riduzione", "calo throughput dopo aumento"
+                self.concorrenza = max(CONCORRENZA_MIN, self.concorrenza // 2)
+            elif self.concorrenza < self.concorrenza_max:
+                azione, motivo = "aumento", "throughput stabile"
+                self.concorrenza += 1
+            else:
+                azione, motivo = "stabile", "concorrenza massima"
+            if tp is not None and byte >= CAMPIONE_MIN_BYTES: self._ultimo_tp = tp
+
+        self._ultima_azione = azione
+        decisione = {
+            "etichetta": etichetta, "concorrenza": usata, "throughput_bps": tp or 0.0,
+            "tasso_errori": tasso_errori, "azione": azione, "motivo": motivo,
+            "prossima_concorrenza": self.concorrenza,
+            "prossimi_retry": self.retry, "prossima_attesa": self.attesa
+        }
+        self.decisioni.append(decisione)
+        return decisione
+
+
+class LimitatoreBanda:
+    """Token bucket condiviso tra thread: consuma(n) attende finché n byte sono ammessi."""
+
+    def __init__(self, limite_bps, burst_secondi=0.5):
+        self.limite_bps = float(limite_bps)
+        self.capacita = max(64 * 1024, self.limite_bps * burst_secondi)
+        self._gettoni = self.capacita
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consuma(self, n):
+        with self._lock:
+            adesso = time.monotonic()
+            self._gettoni = min(self.capacita, self._gettoni + (adesso - self._ultimo) * self.limite_bps)
+            self._ultimo = adesso
+            self._gettoni -= n
+            attesa = -self._gettoni / self.limite_bps if self._gettoni < 0 else 0.0
+        if attesa > 0: time.sleep(attesa)
+
+
+def limite_banda_attivo(conf, adesso=None):
+    """
+    Limite di banda in byte/s per l'ora corrente (0 = nessun limite).
+    conf: {"limite_banda_mbps": 50, "limite_dalle": "08:00", "limite_alle": "20:00"};
+    la fascia può scavalcare la mezzanotte, senza fascia il limite vale sempre.
+    """
+    mbps = (conf or {}).get("limite_banda_mbps") or 0
+    if mbps <= 0: return 0
+    dalle, alle = conf.get("limite_dalle"), conf.get("limite_alle")
+    if dalle and alle:
+        adesso = (adesso or datetime.datetime.now()).time()
+        inizio = datetime.datetime.strptime(dalle, "%H:%M").time()
+        fine = datetime.datetime.strptime(alle, "%H:%M").time()
+        dentro = inizio <= adesso < fine if inizio <= fine else (adesso >= inizio or adesso < fine)
+        if not dentro: return 0
+    return int(mbps * 1_000_000 / 8)
+
+# --- COPIA MULTI-FLUSSO ---
+# I file molto grandi vengono divisi in intervalli copiati in parallelo dentro
+# un temporaneo preallocato, rinominato solo a copia completa e verificata.
+SOGLIA_MULTIFLUSSO = 1024 * 1024 * 1024
+DIM_INTERVALLO = 64 * 1024 * 1024
+BUFFER_INTERVALLO = 4 * 1024 * 1024
+FLUSSI_DEFAULT = 4
+SUFFISSO_TMP = ".scriba_tmp"
+
+def _pread(f, n, offset):
+    # os.pread non esiste su Windows: ogni thread ha il proprio handle, quindi seek+read è sicuro
+    if hasattr(os, "pread"): return os.pread(f.fileno(), n, offset)
+    f.seek(offset)
+    return f.read(n)
+
+def _pwrite(f, dati, offset):
+    if hasattr(os, "pwrite"):
+        scritti = 0
+        while scritti < len(dati):
+            scritti += os.pwrite(f.fileno(), dati[scritti:], offset + scritti)
+        return
+    f.seek(offset)
+    f.write(dati)
+
+def _copia_intervallo(src, tmp, inizio, lunghezza, verifica, limitatore):
+    """
+    Copia un intervallo. Con verifica ne confronta il checksum con quanto riletto
+    dalla destinazione (fsync + rilettura: raddoppia il traffico su un NAS).
+    """
+    h_src = hashlib.blake2b()
+    with open(src, 'rb', buffering=0) as fs, open(tmp, 'r+b', buffering=0) as fd:
+        pos, fine = inizio, inizio + lunghezza
+        while pos < fine:
+            dati = _pread(fs, min(BUFFER_INTERVALLO, fine - pos), pos)
+            if not dati: raise OSError(f"Lettura troncata a {pos} byte: {src}")
+            if verifica: h_src.update(dati)
+            if limitatore: limitatore.consuma(len(dati))
+            _pwrite(fd, dati, pos)
+            pos += len(dati)
+        if not verifica: return
+        if hasattr(os, "fsync"): os.fsync(fd.fileno())
+        h_dst = hashlib.blake2b()
+        pos = inizio
+        while pos < fine:
+            dati = _pread(fd, min(BUFFER_INTERVALLO, fine - pos), pos)
+            if not dati: break
+            h_dst.update(dati)
+            pos += len(dati)
+    if h_dst.digest() != h_src.digest():
+        raise OSError(f"Checksum non corrispondente nell'intervallo {inizio}-{fine}: {tmp}")
+
+def copia_multiflusso(src, dst, flussi=FLUSSI_DEFAULT, dim_intervallo=DIM_INTERVALLO,
+                      retry=RETRY_BASE, attesa=ATTESA_BASE, verifica=False, limitatore=None):
+    """
+    Copia src in dst con più flussi paralleli (pread/pwrite per intervallo).
+    In caso di errore si ritenta solo l'intervallo; con verifica ogni intervallo
+    viene riletto e confrontato col checksum dell'origine. Se l'origine cambia
+    (dimensione o data) durante la copia, la copia fallisce.
+    Restituisce {"byte", "secondi", "intervalli", "ritentati"}; solleva OSError se
+    un intervallo fallisce anche dopo i tentativi (il temporaneo viene eliminato).
+    """
+    inizio_copia = time.monotonic()
+    st_iniziale = os.stat(src)
+    size = st_iniziale.st_size
+    tmp = dst + SUFFISSO_TMP
+    os.makedirs(os.path.dirname(dst) or ".", exist_ok=True)
+    with open(tmp, 'wb') as f:
+        # Preallocazione: evita frammentazione e crescita concorrente del file
+        if size and hasattr(os, "posix_fallocate"):
+            try: os.posix_fallocate(f.fileno(), 0, size)
+            except OSError: f.truncate(size)
+        else: f.truncate(size)
+
+    intervalli = [(o, min(dim_intervallo, size - o)) for o in range(0, size, dim_intervallo)]
+    ritentati = [0]
+    lock = threading.Lock()
+
+    def _lavoro(intervallo):
+        for tentativo in range(retry + 1):
+            try:
+                return _copia_intervallo(src, tmp, intervallo[0], intervallo[1], verifica, limitatore)
+            except OSError:
+                if tentativo >= retry: raise
+                with lock: ritentati[0] += 1
+                time.sleep(attesa)
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, flussi)) as pool:
+            for _ in pool.map(_lavoro, intervalli): pass
+        st_finale = os.stat(src)
+        if (st_finale.st_size, st_finale.st_mtime_ns) != (size, st_iniziale.st_mtime_ns):
+            raise OSError(f"Origine modificata durante la copia: {src}")
+        shutil.copystat(src, tmp)
+        os.replace(tmp, dst)
+    except BaseException:
+        try: os.remove(tmp)
+        except OSError: pass
+        raise
+    return {"byte": size, "secondi": time.monotonic() - inizio_copia,
+            "intervalli": len(intervalli), "ritentati": ritentati[0]}
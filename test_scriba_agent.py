@@ -0,0 +1,194 @@
+# Scriba by Gabriele Battaglia (IZ4APU)
+# Test di scriba_agent: agente e client reali su 127.0.0.1 (porta libera).
+# Uso: python -m pytest test_scriba_agent.py
+
+import os
+import socket
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import scriba_agent
+import scriba_engine as engine
+
+class TestAgenteLoopback(unittest.TestCase):
+
+    TOKEN = "tòk segreto"
+
+    def setUp(self):
+        self.dir_src = tempfile.mkdtemp(prefix="scriba_test_src_")
+        self.dir_dst = tempfile.mkdtemp(prefix="scriba_test_dst_")
+        self.server = scriba_agent.ServerAgente(self.dir_dst, "127.0.0.1", 0, self.TOKEN)
+        self.porta = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.dir_src, ignore_errors=True)
+        shutil.rmtree(self.dir_dst, ignore_errors=True)
+
+    def _client(self, token=None):
+        return scriba_agent.ClientAgente("127.0.0.1", self.porta, self.TOKEN if token is None else token)
+
+    def _file_locale(self, nome, dati):
+        path = os.path.join(self.dir_src, nome)
+        with open(path, 'wb') as f: f.write(dati)
+        return path
+
+    def test_scrivi_lista_elimina(self):
+        a = self._file_locale("a.bin", os.urandom(3 * scriba_agent.BLOCCO_IO + 7))
+        b = self._file_locale("b.txt", b"")
+        with self._client() as client:
+            self.assertEqual(client.crea_dir(["set", "set/sub"]), [])
+            esiti = client.scrivi([(a, "set/sub/a.bin"), (b, "set/b.txt")])
+            self.assertEqual(esiti, [(True, None), (True, None)])
+            with open(a, 'rb') as f1, open(os.path.join(self.dir_dst, "set", "sub", "a.bin"), 'rb') as f2:
+                self.assertEqual(f1.read(), f2.read())
+            self.assertEqual(os.stat(os.path.join(self.dir_dst, "set", "sub", "a.bin")).st_mtime_ns,
+                             os.stat(a).st_mtime_ns)
+
+            albero = client.lista("set")
+            self.assertEqual(albero.num_file(), 2)
+            self.assertEqual(sorted(albero.percorso(i, "/") for i in range(1, len(albero))),
+                             ["b.txt", "sub", "sub/a.bin"])
+
+            self.assertEqual(client.elimina(["set/sub"]), [])
+            self.assertFalse(os.path.exists(os.path.join(self.dir_dst, "set", "sub")))
+            self.assertEqual(client.ping()["ok"], True)
+
+    def test_percorso_fuori_root(self):
+        a = self._file_locale("a.bin", b"dati")
+        with self._client() as client:
+            esiti = client.scrivi([(a, "../fuori.bin"), (a, "dentro.bin")])
+            self.assertFalse(esiti[0][0])
+            self.assertEqual(esiti[1], (True, None))
+            with self.assertRaises(scriba_agent.ErroreAgente):
+                client.lista("..")
+        self.assertFalse(os.path.exists(os.path.join(os.path.dirname(self.dir_dst), "fuori.bin")))
+
+    def test_token_errato(self):
+        with self._client("sbagliato") as client:
+            with self.assertRaises(scriba_agent.ErroreAgente):
+                client.ping()
+        with self._client("tòk sbagliato") as client:
+            with self.assertRaises(scriba_agent.ErroreAgente):
+                client.ping()
+
+    def test_digest_diverso_non_sostituisce(self):
+        originale = os.path.join(self.dir_dst, "x.bin")
+        with open(originale, 'wb') as f: f.write(b"vecchio")
+        # Frame valido ma con digest sbagliato: l'agente deve scartare il temporaneo
+        with self._client() as client:
+            dati = b"nuovo contenuto"
+            scriba_agent.invia_msg(client.sock, {
+                "cmd": "scrivi", "file": [["x.bin", len(dati), 0]], "token": self.TOKEN,
+                "payload": len(dati) + 1 + scriba_agent.DIM_DIGEST})
+            client.sock.sendall(dati + scriba_agent.ESITO_OK + b"\0" * scriba_agent.DIM_DIGEST)
+            risposta = scriba_agent.ricevi_header(client.sock)
+            self.assertFalse(risposta["risultati"][0]["ok"])
+            # Il flusso resta allineato: la richiesta successiva funziona
+            self.assertEqual(client.ping()["ok"], True)
+        with open(originale, 'rb') as f: self.assertEqual(f.read(), b"vecchio")
+        self.assertFalse(os.path.exists(originale + scriba_agent.SUFFISSO_TMP))
+
+    def test_pausa_lunga_tra_richieste(self):
+        # Il client scansiona l'origine tra una richiesta e l'altra: nessun timeout di inattività
+        vecchio = scriba_agent.TIMEOUT_SOCKET
+        scriba_agent.TIMEOUT_SOCKET = 0.3
+        try:
+            with self._client() as client:
+                client.ping()
+                time.sleep(1.0)
+                self.assertEqual(client.ping()["ok"], True)
+        finally:
+            scriba_agent.TIMEOUT_SOCKET = vecchio
+
+    def test_riconnetti(self):
+        with self._client() as client:
+            client.sock.close()
+            with self.assertRaises(OSError):
+                client.ping()
+            client.riconnetti()
+            self.assertEqual(client.ping()["ok"], True)
+
+    def test_lista_a_frame_durante_scansione(self):
+        vecchio = scriba_agent.INTERVALLO_FRAME
+        scriba_agent.INTERVALLO_FRAME = 0
+        try:
+            for d in range(5):
+                os.makedirs(os.path.join(self.dir_dst, "set", f"d{d}", "sub"))
+                for f in range(3):
+                    with open(os.path.join(self.dir_dst, "set", f"d{d}", "sub", f"f{f}"), 'wb') as fh:
+                        fh.write(b"x" * f)
+            with self._client() as client:
+                albero = client.lista("set")
+            self.assertEqual(albero.num_file(), 15)
+            self.assertEqual(len(albero), 1 + 5 * 2 + 15)
+            self.assertIn("d3/sub/f2", [albero.percorso(i, "/") for i in range(1, len(albero))])
+        finally:
+            scriba_agent.INTERVALLO_FRAME = vecchio
+
+    @unittest.skipUnless(os.name == "posix", "nomi non UTF-8 solo su filesystem POSIX")
+    def test_nome_non_utf8(self):
+        os.makedirs(os.path.join(self.dir_dst, "set"))
+        nome_bytes = os.path.join(os.fsencode(self.dir_dst), b"set", b"caf\xe9.mp3")
+        try:
+            with open(nome_bytes, 'wb') as f: f.write(b"musica")
+        except OSError:
+            self.skipTest("Il filesystem non accetta nomi non UTF-8")
+        with self._client() as client:
+            albero = client.lista("set")
+            nome = albero.nome(1)
+            self.assertEqual(os.fsencode(nome), b"caf\xe9.mp3")
+            self.assertEqual(client.stat([f"set/{nome}"])[0][0], 6)
+            self.assertEqual(client.elimina([f"set/{nome}"]), [])
+        self.assertFalse(os.path.exists(nome_bytes))
+
+    def test_senza_token_solo_locale(self):
+        with self.assertRaises(scriba_agent.ErroreAgente):
+            scriba_agent.ServerAgente(self.dir_dst, "0.0.0.0", 0, "")
+
+
+class TestListaRimappata(unittest.TestCase):
+    """
+    Un agente su un altro sistema può ordinare i figli diversamente dal client
+    (es. Windows senza distinzione di maiuscole): gli indici vanno rimappati
+    prima del diff, altrimenti i file finiscono sotto la cartella sbagliata.
+    """
+
+    def test_ordine_server_diverso(self):
+        lato_client, lato_server = socket.socketpair()
+        # Ordine "Windows": alfa < Beta; su POSIX il client ordina Beta < alfa
+        frame = [[0, "alfa", True, 0, 0], [0, "Beta", True, 0, 0],
+                 [1, "x.txt", False, 5, 100], [2, "y.txt", False, 7, 200]]
+
+        def _agente_finto():
+            scriba_agent.ricevi_header(lato_server)
+            scriba_agent.invia_msg(lato_server, {"ok": True, "voci": frame[:3], "fine": False})
+            scriba_agent.invia_msg(lato_server, {"ok": True, "voci": frame[3:], "fine": True, "errori": 0})
+
+        threading.Thread(target=_agente_finto, daemon=True).start()
+        client = scriba_agent.ClientAgente.__new__(scriba_agent.ClientAgente)
+        client.token, client.sock = "", lato_client
+        try:
+            remoto = client.lista("")
+        finally:
+            lato_client.close()
+            lato_server.close()
+
+        locale = engine.AlberoCompatto()
+        locale.aggiungi_figli(0, [("alfa", True, 0, 0), ("Beta", True, 0, 0)])
+        for f in locale.figli(0):
+            if locale.nome(f) == "alfa": locale.aggiungi_figli(f, [("x.txt", False, 5, 100)])
+            else: locale.aggiungi_figli(f, [("y.txt", False, 7, 200)])
+        locale.congela()
+
+        self.assertEqual(sorted(remoto.percorso(i, "/") for i in range(1, len(remoto))),
+                         ["Beta", "Beta/y.txt", "alfa", "alfa/x.txt"])
+        self.assertEqual(list(engine.diff_alberi(locale, remoto)), [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,282 @@
+# Scriba by Gabriele Battaglia (IZ4APU)
+# Test di scriba_engine: albero compatto, diff in streaming, controllo adattivo,
+# copia multi-flusso.
+# Uso: python -m pytest test_scriba_engine.py
+
+import os
+import datetime
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import scriba_engine as engine
+
+MTIME = 1_700_000_000_000_000_000
+
+def _albero(struttura):
+    """struttura: {nome: (size, mtime_ns) per i file, dict per le cartelle}"""
+    albero = engine.AlberoCompatto()
+    def _aggiungi(parent, contenuto):
+        voci = [(nome, isinstance(v, dict), *((0, 0) if isinstance(v, dict) else v))
+                for nome, v in contenuto.items()]
+        primo = albero.aggiungi_figli(parent, voci)
+        if primo < 0: return
+        for f in albero.figli(parent):
+            nome = albero.nome(f)
+            if isinstance(contenuto[nome], dict): _aggiungi(f, contenuto[nome])
+    _aggiungi(0, struttura)
+    return albero.congela()
+
+def diff_come_percorsi(src, dst):
+    risultato = set()
+    for azione, i, j in engine.diff_alberi(src, dst):
+        albero, idx = (dst, j) if azione == engine.DIFF_EXTRA else (src, i)
+        risultato.add((azione, albero.percorso(idx, "/")))
+    return risultato
+
+
+class TestDiffAlberi(unittest.TestCase):
+
+    def test_alberi_identici(self):
+        s = {"Musica": {"a.flac": (10, MTIME), "b.flac": (20, MTIME)}, "x.txt": (1, MTIME)}
+        self.assertEqual(diff_come_percorsi(_albero(s), _albero(s)), set())
+
+    def test_nuovi_modificati_extra(self):
+        src = _albero({"A": {"1.txt": (5, MTIME), "2.txt": (6, MTIME)}, "nuovo.txt": (1, MTIME)})
+        dst = _albero({"A": {"1.txt": (5, MTIME), "2.txt": (7, MTIME)}, "vecchio.txt": (1, MTIME)})
+        self.assertEqual(diff_come_percorsi(src, dst), {
+            (engine.DIFF_MODIFICATO, "A/2.txt"),
+            (engine.DIFF_NUOVO, "nuovo.txt"),
+            (engine.DIFF_EXTRA, "vecchio.txt"),
+        })
+
+    def test_tolleranza_mtime(self):
+        # Come /FFT: fino a 2 secondi di differenza il file è invariato
+        src = _albero({"f": (5, MTIME)})
+        self.assertEqual(diff_come_percorsi(src, _albero({"f": (5, MTIME + 1_999_999_999)})), set())
+        self.assertEqual(diff_come_percorsi(src, _albero({"f": (5, MTIME + 3_000_000_000)})),
+                         {(engine.DIFF_MODIFICATO, "f")})
+
+    def test_cartella_nuova_con_contenuto(self):
+        src = _albero({"Album": {"CD1": {"01.flac": (1, MTIME)}, "cover.jpg": (2, MTIME)}})
+        self.assertEqual(diff_come_percorsi(src, _albero({})), {
+            (engine.DIFF_NUOVO, "Album"), (engine.DIFF_NUOVO, "Album/CD1"),
+            (engine.DIFF_NUOVO, "Album/CD1/01.flac"), (engine.DIFF_NUOVO, "Album/cover.jpg"),
+        })
+
+    def test_cartella_extra_solo_radice(self):
+        # Per le cartelle EXTRA basta la cartella: l'eliminazione è ricorsiva
+        dst = _albero({"Vecchio": {"sub": {"a": (1, MTIME)}, "b": (1, MTIME)}})
+        self.assertEqual(diff_come_percorsi(_albero({}), dst), {(engine.DIFF_EXTRA, "Vecchio")})
+
+    def test_file_diventato_cartella(self):
+        src = _albero({"voce": {"dentro.txt": (1, MTIME)}})
+        dst = _albero({"voce": (9, MTIME)})
+        azioni = list(engine.diff_alberi(src, dst))
+        # L'eliminazione della vecchia voce precede la creazione della nuova
+        self.assertEqual(azioni[0][0], engine.DIFF_EXTRA)
+        self.assertEqual(diff_come_percorsi(src, dst), {
+            (engine.DIFF_EXTRA, "voce"), (engine.DIFF_NUOVO, "voce"), (engine.DIFF_NUOVO, "voce/dentro.txt"),
+        })
+
+    def test_cartella_diventata_file(self):
+        src = _albero({"voce": (9, MTIME)})
+        dst = _albero({"voce": {"dentro.txt": (1, MTIME)}})
+        self.assertEqual(diff_come_percorsi(src, dst), {(engine.DIFF_EXTRA, "voce"), (engine.DIFF_NUOVO, "voce")})
+
+    def test_maiuscole(self):
+        src = _albero({"Brano.MP3": (1, MTIME), "alfa": (1, MTIME), "Beta": (1, MTIME)})
+        dst = _albero({"brano.mp3": (1, MTIME), "alfa": (1, MTIME), "Beta": (1, MTIME)})
+        if os.path.normcase("A") == "a":
+            # Windows: nomi che differiscono solo per maiuscole sono la stessa voce
+            self.assertEqual(diff_come_percorsi(src, dst), set())
+        else:
+            self.assertEqual(diff_come_percorsi(src, dst),
+                             {(engine.DIFF_NUOVO, "Brano.MP3"), (engine.DIFF_EXTRA, "brano.mp3")})
+
+    def test_scansione_reale(self):
+        root = tempfile.mkdtemp(prefix="scriba_test_")
+        try:
+            os.makedirs(os.path.join(root, "a", "b"))
+            with open(os.path.join(root, "a", "b", "f.txt"), 'wb') as f: f.write(b"123")
+            with open(os.path.join(root, "pagefile.sys"), 'wb') as f: f.write(b"x")
+            albero = engine.scansiona_albero(root)
+            self.assertEqual(sorted(albero.percorso(i, "/") for i in range(1, len(albero))),
+                             ["a", "a/b", "a/b/f.txt"])
+            self.assertEqual(albero.byte_totali(), 3)
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+GB = 1024 ** 3
+
+class TestControlloreAdattivo(unittest.TestCase):
+
+    def test_aumento_additivo_fino_al_massimo(self):
+        c = engine.ControlloreAdattivo(3, concorrenza_max=5)
+        for _ in range(4): c.registra("x", GB, 10.0, 100, 0)
+        self.assertEqual(c.concorrenza, 5)
+        self.assertEqual(c.decisioni[-1]["motivo"], "concorrenza massima")
+
+    def test_calo_throughput_dopo_aumento(self):
+        c = engine.ControlloreAdattivo(8, concorrenza_max=16)
+        c.registra("a", GB, 10.0, 100, 0)           # aumento a 9
+        d = c.registra("b", GB, 20.0, 100, 0)       # throughput dimezzato
+        self.assertEqual(d["azione"], "riduzione")
+        self.assertEqual(c.concorrenza, 4)
+
+    def test_errori_dimezzano_e_allungano_il_backoff(self):
+        c = engine.ControlloreAdattivo(8)
+        d = c.registra("a", GB, 10.0, 90, 10)
+        self.assertEqual(d["motivo"], "errori 10.0%")
+        self.assertEqual(c.parametri(), {"concorrenza": 4, "retry": engine.RETRY_BASE + 1,
+                                         "attesa": engine.ATTESA_BASE * 2})
+        # Senza errori il backoff torna gradualmente ai valori base
+        c.registra("b", GB, 10.0, 100, 0)
+        self.assertEqual((c.retry, c.attesa), (engine.RETRY_BASE, engine.ATTESA_BASE))
+
+    def test_errori_contano_anche_senza_tempo_di_copia(self):
+        c = engine.ControlloreAdattivo(8)
+        self.assertEqual(c.registra("a", 0, None, 0, 3)["azione"], "riduzione")
+
+    def test_tempo_ignoto_o_campione_piccolo(self):
+        # Una cartella quasi invariata dopo una grande non deve dimezzare la concorrenza
+        c = engine.ControlloreAdattivo(4, concorrenza_max=16)
+        c.registra("Film", 20 * GB, 200.0, 10, 0)
+        for byte, secondi in ((10 * 1024 * 1024, 60.0), (GB, None)):
+            d = c.registra("Musica", byte, secondi, 5000, 0)
+            self.assertEqual((d["azione"], d["motivo"]), ("stabile", "campione insufficiente"))
+        self.assertEqual(c.concorrenza, 5)
+
+    def test_limiti_concorrenza(self):
+        c = engine.ControlloreAdattivo(100, concorrenza_max=1000)
+        self.assertEqual(c.concorrenza, engine.CONCORRENZA_MAX)
+        c = engine.ControlloreAdattivo(1)
+        c.registra("a", GB, 10.0, 0, 5)
+        self.assertEqual(c.concorrenza, engine.CONCORRENZA_MIN)
+
+
+class TestLimiteBanda(unittest.TestCase):
+
+    def _alle(self, ora):
+        return datetime.datetime.combine(datetime.date(2026, 1, 1), datetime.time.fromisoformat(ora))
+
+    def test_senza_limite(self):
+        self.assertEqual(engine.limite_banda_attivo({"limite_banda_mbps": 0}), 0)
+        self.assertEqual(engine.limite_banda_attivo(None), 0)
+
+    def test_fascia_diurna(self):
+        conf = {"limite_banda_mbps": 80, "limite_dalle": "08:00", "limite_alle": "20:00"}
+        self.assertEqual(engine.limite_banda_attivo(conf, self._alle("12:00")), 10_000_000)
+        self.assertEqual(engine.limite_banda_attivo(conf, self._alle("20:00")), 0)
+        self.assertEqual(engine.limite_banda_attivo(conf, self._alle("07:59")), 0)
+
+    def test_fascia_che_scavalca_la_mezzanotte(self):
+        conf = {"limite_banda_mbps": 8, "limite_dalle": "22:00", "limite_alle": "06:00"}
+        self.assertEqual(engine.limite_banda_attivo(conf, self._alle("23:30")), 1_000_000)
+        self.assertEqual(engine.limite_banda_attivo(conf, self._alle("00:00")), 1_000_000)
+        self.assertEqual(engine.limite_banda_attivo(conf, self._alle("05:59")), 1_000_000)
+        self.assertEqual(engine.limite_banda_attivo(conf, self._alle("06:00")), 0)
+        self.assertEqual(engine.limite_banda_attivo(conf, self._alle("12:00")), 0)
+
+    def test_senza_fascia_vale_sempre(self):
+        self.assertEqual(engine.limite_banda_attivo({"limite_banda_mbps": 8}, self._alle("03:00")), 1_000_000)
+
+
+class TestCopiaMultiflusso(unittest.TestCase):
+
+    DIM = 1000
+
+    def setUp(self):
+        self.cartella = tempfile.mkdtemp(prefix="scriba_test_")
+        self.src = os.path.join(self.cartella, "grande.bin")
+        self.dst = os.path.join(self.cartella, "copia", "grande.bin")
+        self.dati = os.urandom(5 * self.DIM + 123)
+        with open(self.src, 'wb') as f: f.write(self.dati)
+
+    def tearDown(self):
+        shutil.rmtree(self.cartella, ignore_errors=True)
+
+    def _copia(self, **kwargs):
+        return engine.copia_multiflusso(self.src, self.dst, flussi=3, dim_intervallo=self.DIM,
+                                        attesa=0, **kwargs)
+
+    def _letto(self):
+        with open(self.dst, 'rb') as f: return f.read()
+
+    def test_copia_completa(self):
+        for verifica in (False, True):
+            esito = self._copia(verifica=verifica)
+            self.assertEqual(self._letto(), self.dati)
+            self.assertEqual((esito["byte"], esito["intervalli"], esito["ritentati"]), (len(self.dati), 6, 0))
+            self.assertEqual(os.stat(self.dst).st_mtime_ns, os.stat(self.src).st_mtime_ns)
+            self.assertFalse(os.path.exists(self.dst + engine.SUFFISSO_TMP))
+
+    def test_file_vuoto(self):
+        with open(self.src, 'wb'): pass
+        self.assertEqual(self._copia()["intervalli"], 0)
+        self.assertEqual(self._letto(), b"")
+
+    def test_ritenta_solo_intervallo_fallito(self):
+        originale = engine._copia_intervallo
+        chiamate = []
+
+        def _fallisce_una_volta(src, tmp, inizio, *args):
+            chiamate.append(inizio)
+            if inizio == 2 * self.DIM and chiamate.count(inizio) == 1:
+                raise OSError("rete interrotta")
+            return originale(src, tmp, inizio, *args)
+
+        with mock.patch.object(engine, "_copia_intervallo", _fallisce_una_volta):
+            esito = self._copia(retry=1)
+        self.assertEqual(esito["ritentati"], 1)
+        self.assertEqual(sorted(chiamate), sorted([k * self.DIM for k in range(6)] + [2 * self.DIM]))
+        self.assertEqual(self._letto(), self.dati)
+
+    def test_errore_definitivo_elimina_temporaneo(self):
+        def _fallisce(src, tmp, inizio, *args):
+            raise OSError("disco pieno")
+        with mock.patch.object(engine, "_copia_intervallo", _fallisce):
+            with self.assertRaises(OSError):
+                self._copia(retry=2)
+        self.assertFalse(os.path.exists(self.dst))
+        self.assertFalse(os.path.exists(self.dst + engine.SUFFISSO_TMP))
+
+    def test_destinazione_precedente_intatta_se_fallisce(self):
+        os.makedirs(os.path.dirname(self.dst))
+        with open(self.dst, 'wb') as f: f.write(b"versione precedente")
+        with mock.patch.object(engine, "_copia_intervallo", mock.Mock(side_effect=OSError("errore"))):
+            with self.assertRaises(OSError):
+                self._copia(retry=0)
+        self.assertEqual(self._letto(), b"versione precedente")
+
+    def test_origine_modificata_durante_la_copia(self):
+        originale = engine._copia_intervallo
+
+        def _modifica_origine(src, tmp, inizio, *args):
+            originale(src, tmp, inizio, *args)
+            if inizio == 0:
+                st = os.stat(src)
+                os.utime(src, ns=(st.st_atime_ns, st.st_mtime_ns + 5_000_000_000))
+
+        with mock.patch.object(engine, "_copia_intervallo", _modifica_origine):
+            with self.assertRaises(OSError):
+                self._copia()
+        self.assertFalse(os.path.exists(self.dst))
+        self.assertFalse(os.path.exists(self.dst + engine.SUFFISSO_TMP))
+
+    def test_verifica_rileva_scrittura_corrotta(self):
+        originale = engine._pwrite
+
+        def _corrompe(f, dati, offset):
+            if offset == self.DIM: dati = bytes([dati[0] ^ 0xFF]) + dati[1:]
+            originale(f, dati, offset)
+
+        with mock.patch.object(engine, "_pwrite", _corrompe):
+            with self.assertRaises(OSError):
+                self._copia(verifica=True, retry=0)
+        self.assertFalse(os.path.exists(self.dst + engine.SUFFISSO_TMP))
+
+if __name__ == "__main__":
+    unittest.main()